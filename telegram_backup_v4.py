@@ -1,17 +1,1173 @@
 import asyncio
 import threading
-import schedule
 import time
 import os
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
 import datetime
 import json
+import sys
 import queue
+import heapq
+import collections
+import itertools
+import functools
+import html
+import hashlib
+import shutil
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
 
+# telethon, schedule and boto3 are imported where they are first needed so the
+# window comes up without paying for them
+
+SESSION_NAME = "telegram_backup_session"
+APP_CONFIG_FILE = "app_config.json"
+CHATS_CACHE_FILE = "chats_cache.json"
+STARTUP_BUDGET = 0.5
 LAST_IDS_FILE = "last_ids.json"
+STATS_FILE = "backup_stats.json"
+FETCH_LIMIT = 200
+BACKUP_WORKERS = 3
+
+# Planning: a few recent messages per chat are sampled to estimate the run
+PLAN_SAMPLE_SIZE = 50
+SECONDS_PER_MESSAGE = 0.05
+SECONDS_PER_MEDIA_BYTE = 1 / 1_000_000
+
+# Backfill: chats further behind than FETCH_LIMIT are fetched in id ranges
+BACKFILL_RANGE_SIZE = 5000
+BACKFILL_CONCURRENCY = 4
+
+# Live mode: events are written in small batches, with a periodic catch-up poll
+LIVE_FLUSH_INTERVAL = 5
+LIVE_BATCH_SIZE = 50
+LIVE_RECONCILE_INTERVAL = 600
+
+# Disk writer: all file output goes through one thread, batched per file
+WRITER_QUEUE_SIZE = 1000
+WRITER_FLUSH_INTERVAL = 2
+WRITER_MAX_PENDING = 500
+
+# Profiling: stack sampling period for the optional per-run profile
+PROFILE_INTERVAL = 0.005
+
+# Failed media downloads (e.g. expired file references) are retried with backoff
+RETRY_FILE = "media_retries.json"
+RETRY_POLL_INTERVAL = 30
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+RETRY_BATCH_SIZE = 100
+
+# Retention: sizes are tracked in a ledger as files are written, so pruning never
+# walks the media trees. RETENTION_KEEP_DAYS=0 and RETENTION_MAX_CHAT_MB=0 disable it.
+# Each backup_<date> folder only holds the messages that were new that day, so a
+# pruned day's messages are gone for good and a kept "monthly" day is that day's
+# messages only, not a full copy of the chat.
+LEDGER_FILE = "size_ledger.json"
+RETENTION_KEEP_DAYS = int(os.environ.get("RETENTION_KEEP_DAYS", "0"))
+RETENTION_KEEP_MONTHLY = int(os.environ.get("RETENTION_KEEP_MONTHLY", "12"))
+RETENTION_MAX_CHAT_BYTES = int(os.environ.get("RETENTION_MAX_CHAT_MB", "0")) * 1024 * 1024
+
+# Integrity checks: every downloaded media file is recorded in a per-chat manifest
+MEDIA_MANIFEST = "media_manifest.jsonl"
+VERIFY_CACHE_FILE = "verify_cache.json"
+VERIFY_REPORT_FILE = "verify_report.json"
+VERIFY_WORKERS = 8
+
+# Output formats written in a single pass, e.g. EXPORT_FORMATS=html,jsonl,txt
+EXPORT_FORMATS = os.environ.get("EXPORT_FORMATS", "html")
+
+# OUTPUT_MODE=archive stores each chat as compressed, append-only zip segments
+# with an index, instead of loose pages and media files. A segment is closed at
+# the end of a run, or in live mode once it reaches the size or age limit.
+OUTPUT_MODE = os.environ.get("OUTPUT_MODE", "files")
+ARCHIVE_DIR = "archives"
+ARCHIVE_INDEX = "index.jsonl"
+ARCHIVE_BLOCK_MESSAGES = 200
+ARCHIVE_SEGMENT_BYTES = 256 * 1024 * 1024
+ARCHIVE_SEGMENT_SECONDS = 60 * 60
+
+# Optional S3-compatible upload (AWS, MinIO, ...), enabled by setting S3_BUCKET.
+# Credentials come from the usual AWS environment variables or config files.
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_UPLOAD_WORKERS = 4
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_PART_CONCURRENCY = 4
+# Failed uploads are retried with backoff; paths still failing are kept in
+# S3_FAILED_FILE and submitted again the next time the uploader starts
+S3_UPLOAD_ATTEMPTS = 5
+S3_RETRY_BASE_DELAY = 2
+S3_FAILED_FILE = "s3_failed_uploads.json"
+
+
+class MessageRecord:
+    # Only the fields the renderers, checkpoints and media downloads need. Telethon
+    # messages are converted as soon as they arrive so their entities, raw TL
+    # objects and client/sender references can be freed straight away. Messages
+    # with media are the exception: they are kept as source and downloaded through,
+    # so Telethon names files by message date and can refresh expired file
+    # references mid-download.
+    __slots__ = ("id", "date", "edit_date", "sender_id", "text", "grouped_id", "media", "media_size", "source")
+
+    def __init__(self, id, date, edit_date, sender_id, text, grouped_id, media, media_size, source=None):
+        self.id = id
+        self.date = date
+        self.edit_date = edit_date
+        self.sender_id = sender_id
+        self.text = text
+        self.grouped_id = grouped_id
+        self.media = media
+        self.media_size = media_size
+        self.source = source
+
+    @classmethod
+    def from_message(cls, msg):
+        file = msg.file if msg.media else None
+        return cls(msg.id, msg.date, msg.edit_date, msg.sender_id, msg.message or "", msg.grouped_id,
+                   msg.media, (file.size or 0) if file else 0, msg if msg.media else None)
+
+
+def compact(messages):
+    return [MessageRecord.from_message(m) for m in messages]
+
+
+def album_key(msg):
+    return ("album", msg.grouped_id) if msg.grouped_id else ("message", msg.id)
+
+
+def split_trailing_album(messages):
+    # A trailing album may continue past the end of this batch
+    if not messages or not messages[-1].grouped_id:
+        return messages, []
+    start = len(messages)
+    while start > 0 and messages[start - 1].grouped_id == messages[-1].grouped_id:
+        start -= 1
+    return messages[:start], messages[start:]
+
+
+class RunProfiler:
+    # Samples the stacks of every thread (event loop, scheduler, writer, upload and
+    # executor workers) and times each asyncio task created during one backup run.
+    def __init__(self, loop):
+        self.loop = loop
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.tasks = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.loop.set_task_factory(self.task_factory)
+        self.thread.start()
+
+    def stop(self):
+        self.loop.set_task_factory(None)
+        self.stop_event.set()
+        self.thread.join()
+
+    def task_factory(self, loop, coro, **kwargs):
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        name = getattr(coro, "__qualname__", repr(coro))
+        created = time.perf_counter()
+        task.add_done_callback(lambda t: self.tasks.append(
+            (name, created - self.started, time.perf_counter() - created)))
+        return task
+
+    def sample(self):
+        while not self.stop_event.wait(PROFILE_INTERVAL):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                self.stacks[";".join([names.get(ident, str(ident))] + stack[::-1])] += 1
+            self.samples += 1
+
+    def folded_stacks(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def task_timings(self):
+        return [{"task": name, "started": round(start, 4), "duration": round(duration, 4)}
+                for name, start, duration in sorted(self.tasks, key=lambda t: t[2], reverse=True)]
+
+
+class MediaRetryQueue:
+    # Media that failed to download, keyed by chat and message id. Kept in
+    # RETRY_FILE so anything still pending is picked up again on the next run.
+    def __init__(self):
+        self.items = {}
+        if os.path.exists(RETRY_FILE):
+            with open(RETRY_FILE, "r") as f:
+                self.items = json.load(f)
+
+    def add(self, chat_id, folder, message_id, error, file=None):
+        key = f"{chat_id}:{message_id}"
+        attempts = self.items.get(key, {}).get("attempts", 0) + 1
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        # file is set for repairs, which must land under the damaged file's name
+        self.items[key] = {"chat_id": chat_id, "folder": folder, "message_id": message_id, "file": file,
+                           "attempts": attempts, "next_try": time.time() + delay, "error": str(error)}
+
+    def discard(self, chat_id, message_id):
+        return self.items.pop(f"{chat_id}:{message_id}", None) is not None
+
+    def due(self):
+        now = time.time()
+        return [item for item in self.items.values() if item["next_try"] <= now]
+
+    def dump(self):
+        return json.dumps(self.items)
+
+
+class CachedChat:
+    # Stands in for a dialog until dialogs are loaded; Telethon resolves the id
+    # from the entity cache in the session file
+    def __init__(self, chat_id, name):
+        self.id = chat_id
+        self.name = name
+        self.entity = chat_id
+
+
+def read_json(path, default):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return default
+
+
+def has_own_id_sequence(chat_id):
+    # Channels and supergroups number their messages per chat; private chats and
+    # basic groups share one id sequence across the whole account
+    return str(chat_id).startswith("-100")
+
+
+class ChatPlan:
+    def __init__(self, chat_id, name, target, new_messages=0, media_count=0, media_bytes=0, top_id=0,
+                 needs_backfill=False):
+        self.chat_id = chat_id
+        self.name = name
+        self.target = target
+        self.top_id = top_id
+        self.needs_backfill = needs_backfill
+        self.new_messages = new_messages
+        self.media_count = media_count
+        self.media_bytes = media_bytes
+
+    @property
+    def cost(self):
+        return self.new_messages * SECONDS_PER_MESSAGE + self.media_bytes * SECONDS_PER_MEDIA_BYTE
+
+
+def estimate_makespan(costs, workers):
+    # Greedy longest-first assignment, the same order the backup workers use
+    loads = [0.0] * max(1, workers)
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads)
+
+
+def format_size(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+PHOTO_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".bmp"]
+VIDEO_EXTENSIONS = [".mp4", ".mov", ".avi"]
+DOCUMENT_EXTENSIONS = [".pdf", ".doc", ".docx", ".xls", ".xlsx"]
+
+
+def media_kind(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in PHOTO_EXTENSIONS:
+        return "photos"
+    elif ext in VIDEO_EXTENSIONS:
+        return "videos"
+    elif ext in DOCUMENT_EXTENSIONS:
+        return "documents"
+    return "other media"
+
+
+def render_media(filename):
+    kind = media_kind(filename)
+    if kind == "photos":
+        return f'<img class="media" src="media/{filename}" alt="Image"/>'
+    elif kind == "videos":
+        return f'<video class="media" controls><source src="media/{filename}" type="video/mp4">Your browser does not support the video tag.</video>'
+    elif kind == "documents":
+        doc_icon_svg = '''
+            <svg class="doc-icon" fill="none" stroke="currentColor" stroke-width="2" viewBox="0 0 24 24" 
+                 xmlns="http://www.w3.org/2000/svg" aria-hidden="true">
+              <path stroke-linecap="round" stroke-linejoin="round" d="M7 7v10a2 2 0 002 2h6a2 2 0 002-2V7H7z"/>
+              <path stroke-linecap="round" stroke-linejoin="round" d="M7 7l5 5 5-5"/>
+            </svg>
+        '''
+        return f'<div class="document-preview">{doc_icon_svg}<a href="media/{filename}" target="_blank" download>{filename}</a></div>'
+    else:
+        return f'<a href="media/{filename}" target="_blank" download>Download {filename}</a>'
+
+
+class MediaPending:
+    # Stands in for a file name when a download failed and was queued for retry.
+    # Falsy, so everything else reads it as "no file".
+    def __bool__(self):
+        return False
+
+
+MEDIA_PENDING = MediaPending()
+
+
+def render_pending(msg_id):
+    # Stands in for media that failed to download and is queued for retry
+    return f'<div class="media-pending">Media pending (message #{msg_id})</div>'
+
+
+class Exporter:
+    # One output format. Every exporter is fed the same records from a single fetch
+    # and writes its own file, which the DiskWriter buffers separately. render()
+    # runs on the writer thread.
+    filename = None
+
+    def header(self, chat_name):
+        return ""
+
+    def render(self, msg, sender_name, from_me, filename, edited):
+        raise NotImplementedError
+
+    def render_album(self, msgs, sender_name, from_me, filenames, edited):
+        return "".join(self.render(msg, sender_name, from_me, filename, edited)
+                       for msg, filename in zip(msgs, filenames))
+
+    def render_deletion(self, msg_id):
+        return ""
+
+    def render_refetch(self, msg, filename):
+        # Media of an already written message that arrived on a later retry
+        return ""
+
+    def footer(self):
+        return ""
+
+
+class HtmlExporter(Exporter):
+    filename = "messages.html"
+
+    def header(self, chat_name):
+        return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8" />
+<meta name="viewport" content="width=device-width, initial-scale=1" />
+<title>Telegram Backup - {chat_name}</title>
+<style>
+  body {{
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    background: #f5f8fa;
+    padding: 20px;
+  }}
+  .chat-container {{
+    max-width: 600px;
+    margin: auto;
+    background: white;
+    border-radius: 8px;
+    padding: 15px;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+  }}
+  .message {{
+    margin: 10px 0;
+    max-width: 70%;
+    padding: 10px 15px;
+    border-radius: 18px;
+    clear: both;
+    position: relative;
+    font-size: 14px;
+    line-height: 1.3;
+  }}
+  .from-me {{
+    background-color: #dcf8c6;
+    float: right;
+    text-align: right;
+  }}
+  .from-others {{
+    background-color: #fff;
+    border: 1px solid #e2e2e2;
+    float: left;
+    text-align: left;
+  }}
+  .sender {{
+    font-weight: bold;
+    font-size: 13px;
+    margin-bottom: 3px;
+  }}
+  .timestamp {{
+    font-size: 11px;
+    color: #888;
+    margin-top: 5px;
+  }}
+  img.media, video.media {{
+    max-width: 100%;
+    border-radius: 10px;
+    margin-top: 5px;
+  }}
+  .document-preview {{
+    display: flex;
+    align-items: center;
+    margin-top: 5px;
+  }}
+  .doc-icon {{
+    width: 24px;
+    height: 24px;
+    margin-right: 8px;
+    opacity: 0.7;
+  }}
+  a {{
+    color: #065fd4;
+    text-decoration: none;
+  }}
+  a:hover {{
+    text-decoration: underline;
+  }}
+  .edited {{
+    font-style: italic;
+  }}
+  .deleted, .refetched {{
+    float: none;
+    text-align: center;
+    color: #888;
+    font-style: italic;
+  }}
+  .media-pending {{
+    color: #888;
+    font-style: italic;
+    margin-top: 5px;
+  }}
+  .gallery {{
+    display: grid;
+    grid-template-columns: repeat(2, 1fr);
+    gap: 4px;
+  }}
+</style>
+</head>
+<body>
+<div class="chat-container">
+"""
+
+    def render(self, msg, sender_name, from_me, filename, edited):
+        media_html = render_media(filename) if filename else (render_pending(msg.id) if filename is MEDIA_PENDING else "")
+        return self.bubble(msg, sender_name, from_me, msg.text, media_html, edited)
+
+    def render_album(self, msgs, sender_name, from_me, filenames, edited):
+        # The caption is usually on one item only; failed items keep their place
+        text = "\n".join(msg.text for msg in msgs if msg.text)
+        media_html = '<div class="gallery">' + "".join(
+            render_media(f) if f else render_pending(msg.id) for msg, f in zip(msgs, filenames) if f or f is MEDIA_PENDING
+        ) + "</div>"
+        return self.bubble(msgs[0], sender_name, from_me, text, media_html, edited)
+
+    def bubble(self, msg, sender_name, from_me, text, media_html, edited):
+        from_me_class = "from-me" if from_me else "from-others"
+        timestamp = msg.date.strftime("%Y-%m-%d %H:%M")
+        if edited:
+            edit_date = (msg.edit_date or msg.date).strftime("%Y-%m-%d %H:%M")
+            timestamp += f' <span class="edited">(edited {edit_date})</span>'
+
+        # Escape text for HTML safety
+        safe_text = html.escape(text).replace("\n", "<br>")
+
+        return f"""
+                <div class="message {from_me_class}">
+                  <div class="sender">{sender_name}</div>
+                  <div class="text">{safe_text}</div>
+                  {media_html}
+                  <div class="timestamp">{timestamp}</div>
+                </div>
+                """
+
+    def render_deletion(self, msg_id):
+        return f'\n<div class="message deleted">Message #{msg_id} was deleted</div>\n'
+
+    def render_refetch(self, msg, filename):
+        return f'\n<div class="message refetched">Media for message #{msg.id} re-fetched{render_media(filename)}</div>\n'
+
+    def footer(self):
+        return "</div></body></html>"
+
+
+class JsonlExporter(Exporter):
+    filename = "messages.jsonl"
+
+    def render(self, msg, sender_name, from_me, filename, edited):
+        return json.dumps({
+            "id": msg.id,
+            "date": msg.date.isoformat(),
+            "edit_date": msg.edit_date.isoformat() if msg.edit_date else None,
+            "sender_id": msg.sender_id,
+            "sender": sender_name,
+            "text": msg.text,
+            "grouped_id": msg.grouped_id,
+            "media": f"media/{filename}" if filename else None,
+            "media_pending": filename is MEDIA_PENDING,
+            "edited": edited,
+        }, ensure_ascii=False) + "\n"
+
+    def render_deletion(self, msg_id):
+        return json.dumps({"id": msg_id, "deleted": True}) + "\n"
+
+    def render_refetch(self, msg, filename):
+        return json.dumps({"id": msg.id, "refetched": True, "media": f"media/{filename}"}, ensure_ascii=False) + "\n"
+
+
+class TextExporter(Exporter):
+    filename = "messages.txt"
+
+    def render(self, msg, sender_name, from_me, filename, edited):
+        timestamp = msg.date.strftime("%Y-%m-%d %H:%M")
+        if edited:
+            timestamp += " (edited)"
+        media = f" [media/{filename}]" if filename else (" [media pending]" if filename is MEDIA_PENDING else "")
+        # Same line format as the v2 text export
+        return f"[{timestamp}] {sender_name}: {msg.text}{media}\n"
+
+    def render_deletion(self, msg_id):
+        return f"[message #{msg_id} deleted]\n"
+
+    def render_refetch(self, msg, filename):
+        return f"[media for message #{msg.id} re-fetched: media/{filename}]\n"
+
+
+EXPORTERS = {"html": HtmlExporter, "jsonl": JsonlExporter, "txt": TextExporter}
+
+
+
+def write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class SizeLedger:
+    # Bytes written per day, chat and kind ("pages" or a media kind). Updated by the
+    # writer thread as files land on disk and saved on every explicit flush.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fresh = not os.path.exists(LEDGER_FILE)
+        self.data = read_json(LEDGER_FILE, {})
+        self.dirty = False
+
+    @staticmethod
+    def key(path):
+        parts = os.path.normpath(path).split(os.sep)
+        if len(parts) < 3 or not parts[0].startswith("backup_") or not is_chat_id(parts[1]):
+            return None
+        return parts[0][len("backup_"):], parts[1], media_kind(path) if parts[2] == "media" else "pages"
+
+    def seed(self):
+        # Backups written before the ledger existed are measured once, on a thread of
+        # its own. The writer keeps adding meanwhile, so per kind the larger of the
+        # two counts is kept rather than their sum.
+        found = collections.defaultdict(collections.Counter)
+        for backup in os.scandir("."):
+            if backup.is_dir() and backup.name.startswith("backup_"):
+                for folder, _, files in os.walk(backup.path):
+                    for name in files:
+                        path = os.path.relpath(os.path.join(folder, name))
+                        key = self.key(path)
+                        if key:
+                            found[key[:2]][key[2]] += os.path.getsize(path)
+        with self.lock:
+            for (day, chat), counts in found.items():
+                sizes = self.data.setdefault(day, {}).setdefault(chat, {})
+                for kind, num_bytes in counts.items():
+                    sizes[kind] = max(sizes.get(kind, 0), num_bytes)
+            self.dirty = True
+        self.fresh = False
+
+    def add(self, path, num_bytes):
+        key = self.key(path)
+        if not key:
+            return
+        day, chat, kind = key
+        with self.lock:
+            sizes = self.data.setdefault(day, {}).setdefault(chat, {})
+            sizes[kind] = sizes.get(kind, 0) + num_bytes
+            self.dirty = True
+
+    def remove(self, day, chat):
+        with self.lock:
+            sizes = self.data.get(day, {}).pop(chat, {})
+            if day in self.data and not self.data[day]:
+                del self.data[day]
+            self.dirty = True
+        return sum(sizes.values())
+
+    def snapshot(self):
+        with self.lock:
+            return {day: {chat: sum(sizes.values()) for chat, sizes in chats.items()}
+                    for day, chats in self.data.items()}
+
+    def totals(self):
+        by_kind = collections.Counter()
+        with self.lock:
+            for chats in self.data.values():
+                for sizes in chats.values():
+                    by_kind.update(sizes)
+        return by_kind
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            text = json.dumps(self.data)
+            self.dirty = False
+        write_atomic(LEDGER_FILE, text)
+
+
+def prune_backups(ledger, today):
+    # Only the top two directory levels are listed; sizes come from the ledger
+    days = {}
+    for backup in os.scandir("."):
+        if backup.is_dir() and backup.name.startswith("backup_"):
+            days[backup.name[len("backup_"):]] = {e.name for e in os.scandir(backup.path)
+                                                  if e.is_dir() and is_chat_id(e.name)}
+    # The writer thread keeps updating the ledger, so work from a copy
+    sizes = ledger.snapshot()
+    for day, chats in sizes.items():
+        days.setdefault(day, set()).update(chats)
+
+    dated = {}
+    for day in days:
+        try:
+            dated[day] = datetime.date.fromisoformat(day)
+        except ValueError:
+            continue
+
+    doomed = set()
+    if RETENTION_KEEP_DAYS:
+        cutoff = today - datetime.timedelta(days=RETENTION_KEEP_DAYS)
+        # The first backup of each month is kept as a monthly snapshot
+        first_of_month = {}
+        for day in sorted(dated):
+            first_of_month.setdefault(day[:7], day)
+        monthly = set(sorted(first_of_month.values())[-RETENTION_KEEP_MONTHLY:]) if RETENTION_KEEP_MONTHLY else set()
+        for day, date in dated.items():
+            if date <= cutoff and day not in monthly:
+                doomed.update((day, chat) for chat in days[day])
+
+    if RETENTION_MAX_CHAT_BYTES:
+        # Newest first; a chat's latest day is always kept
+        used = collections.Counter()
+        for day in sorted(dated, reverse=True):
+            for chat in days[day]:
+                if (day, chat) in doomed:
+                    continue
+                chat_bytes = sizes.get(day, {}).get(chat, 0)
+                if used[chat] and used[chat] + chat_bytes > RETENTION_MAX_CHAT_BYTES:
+                    doomed.add((day, chat))
+                else:
+                    used[chat] += chat_bytes
+
+    freed = 0
+    for day, chat in sorted(doomed):
+        shutil.rmtree(os.path.join(f"backup_{day}", chat), ignore_errors=True)
+        freed += ledger.remove(day, chat)
+    for day in {day for day, _ in doomed}:
+        # Run reports go with the day once none of its chats are left
+        folder = f"backup_{day}"
+        if os.path.isdir(folder) and not any(e.is_dir() and is_chat_id(e.name) for e in os.scandir(folder)):
+            shutil.rmtree(folder, ignore_errors=True)
+    return len(doomed), freed
+
+
+class ChatArchive:
+    # A chat's archive is a series of zip segments plus index.jsonl, which maps each
+    # message id to its segment, the compressed block holding its record and its
+    # media member. Only the writer thread touches it.
+    def __init__(self, chat_id, on_closed=None):
+        self.chat_id = chat_id
+        self.dir = os.path.join(ARCHIVE_DIR, str(chat_id))
+        self.staging = os.path.join(self.dir, "staging")
+        self.on_closed = on_closed
+        self.zip = None
+
+    def open_segment(self):
+        os.makedirs(self.dir, exist_ok=True)
+        self.segment = f"segment_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.zip"
+        self.zip = zipfile.ZipFile(os.path.join(self.dir, self.segment), "w")
+        self.opened = time.monotonic()
+        self.block = []
+        self.block_ids = []
+        self.index = []
+
+    def add(self, message_id, line, media_path=None):
+        if self.zip is None:
+            self.open_segment()
+        media_member = None
+        if media_path:
+            # Media is already compressed, so it is stored as is; the id keeps names unique
+            media_member = f"media/{message_id}_{os.path.basename(media_path)}"
+            self.zip.write(media_path, media_member, compress_type=zipfile.ZIP_STORED)
+            os.remove(media_path)
+        self.block.append(line)
+        self.block_ids.append((message_id, media_member))
+        if len(self.block) >= ARCHIVE_BLOCK_MESSAGES:
+            self.write_block()
+        self.close_if_due()
+
+    def close_if_due(self):
+        if self.zip is not None and (self.zip.fp.tell() >= ARCHIVE_SEGMENT_BYTES
+                                     or time.monotonic() - self.opened >= ARCHIVE_SEGMENT_SECONDS):
+            self.close()
+
+    def write_block(self):
+        if not self.block:
+            return
+        ids = [message_id for message_id, _ in self.block_ids]
+        member = f"messages/{min(ids)}-{max(ids)}_{len(self.index)}.jsonl"
+        self.zip.writestr(member, "".join(self.block), compress_type=zipfile.ZIP_DEFLATED)
+        for message_id, media_member in self.block_ids:
+            self.index.append({"message_id": message_id, "segment": self.segment,
+                               "block": member, "media": media_member})
+        self.block = []
+        self.block_ids = []
+
+    def close(self):
+        # The index is only appended once the segment is complete on disk
+        if self.zip is None:
+            return
+        self.write_block()
+        self.zip.close()
+        self.zip = None
+        with open(os.path.join(self.dir, ARCHIVE_INDEX), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in self.index))
+        if self.on_closed:
+            self.on_closed(self.chat_id, [os.path.join(self.dir, self.segment), os.path.join(self.dir, ARCHIVE_INDEX)])
+
+
+class ArchiveCheckpoints:
+    # last_ids for archive mode, only touched on the writer thread. An open segment
+    # has no central directory and is lost in a crash, so a chat's checkpoint is held
+    # back until the segment holding its messages is closed.
+    def __init__(self, archives):
+        self.archives = archives
+        self.saved = read_json(LAST_IDS_FILE, {})
+        self.held = {}
+
+    def update(self, last_ids):
+        saved = dict(last_ids)
+        for key, value in last_ids.items():
+            archive = self.archives.get(int(key)) if is_chat_id(key) else None
+            if archive and archive.zip is not None:
+                self.held[key] = value
+                if key in self.saved:
+                    saved[key] = self.saved[key]
+                else:
+                    del saved[key]
+            else:
+                self.held.pop(key, None)
+        self.saved = saved
+        self.write()
+
+    def segment_closed(self, chat_id):
+        key = str(chat_id)
+        if key in self.held:
+            self.saved[key] = self.held.pop(key)
+            self.write()
+
+    def write(self):
+        write_atomic(LAST_IDS_FILE, json.dumps(self.saved))
+
+
+def extract_message(chat_id, message_id, dest="."):
+    # Reads one block and at most one media member; later entries (edits, deletions) win
+    archive_dir = os.path.join(ARCHIVE_DIR, str(chat_id))
+    entry = None
+    with open(os.path.join(archive_dir, ARCHIVE_INDEX), "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            if item["message_id"] == message_id:
+                entry = item
+    if entry is None:
+        return None, None
+
+    with zipfile.ZipFile(os.path.join(archive_dir, entry["segment"])) as zf:
+        records = [json.loads(line) for line in zf.read(entry["block"]).decode("utf-8").splitlines()]
+        record = [r for r in records if r["id"] == message_id][-1]
+        media_path = zf.extract(entry["media"], dest) if entry["media"] else None
+    return record, media_path
+
+
+class DiskWriter:
+    # Runs file writes and HTML rendering on its own thread so the event loop only
+    # does network work. Appends are buffered per file and flushed on a timer.
+    def __init__(self, on_error=None, on_written=None, ledger=None):
+        self.queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self.on_error = on_error
+        self.on_written = on_written
+        self.ledger = ledger
+        self.pending = collections.defaultdict(list)
+        self.pending_count = 0
+        self.checked = set()
+        self.dirty = set()
+        self.thread = threading.Thread(target=self.run, name="disk-writer", daemon=True)
+        self.thread.start()
+        if ledger and ledger.fresh:
+            threading.Thread(target=self.seed_ledger, name="ledger-seed", daemon=True).start()
+
+    def seed_ledger(self):
+        try:
+            self.ledger.seed()
+        except OSError as e:
+            if self.on_error:
+                self.on_error(f"❌ Could not measure existing backups: {e}")
+
+    async def put(self, op):
+        try:
+            self.queue.put_nowait(op)
+        except queue.Full:
+            # Back-pressure without blocking the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.queue.put, op)
+
+    async def create(self, path, header):
+        await self.put(("create", path, header))
+
+    async def append(self, path, chunk):
+        # chunk is a string or a callable that renders one on the writer thread
+        await self.put(("append", path, chunk))
+
+    async def replace(self, path, content, upload=True):
+        # upload=False keeps local-only files (credentials, caches) off the bucket
+        await self.put(("replace", path, (content, upload)))
+
+    async def call(self, func):
+        # Runs func on the writer thread, in order with the other operations
+        await self.put(("call", None, func))
+
+    async def account(self, path):
+        # For files written elsewhere (media downloads), so the size ledger sees them
+        await self.put(("account", path, None))
+
+    async def flush(self):
+        done = Future()
+        await self.put(("flush", None, done))
+        await asyncio.wrap_future(done)
+
+    def run(self):
+        next_flush = time.monotonic() + WRITER_FLUSH_INTERVAL
+        while True:
+            try:
+                kind, path, payload = self.queue.get(timeout=max(0, next_flush - time.monotonic()))
+            except queue.Empty:
+                kind = None
+            try:
+                if kind == "create":
+                    if path not in self.checked:
+                        self.checked.add(path)
+                        if not os.path.exists(path):
+                            self.pending[path].insert(0, payload)
+                            self.pending_count += 1
+                elif kind == "append":
+                    self.pending[path].append(payload)
+                    self.pending_count += 1
+                elif kind == "replace":
+                    # State files are only written once the data they describe is on
+                    # disk; if that fails the replace is refused and the error reported
+                    self.write_pending()
+                    content, upload = payload
+                    write_atomic(path, content)
+                    if upload:
+                        self.notify_written([path])
+                elif kind == "call":
+                    payload()
+                elif kind == "account":
+                    if self.ledger:
+                        self.ledger.add(path, os.path.getsize(path))
+                elif kind == "flush":
+                    self.write_pending()
+                    # Appended files are only reported on explicit flushes, not every timer tick
+                    dirty, self.dirty = self.dirty, set()
+                    self.notify_written(dirty)
+                    if self.ledger:
+                        self.ledger.save()
+                    payload.set_result(None)
+
+                if self.pending_count >= WRITER_MAX_PENDING or time.monotonic() >= next_flush:
+                    self.write_pending()
+                    next_flush = time.monotonic() + WRITER_FLUSH_INTERVAL
+            except Exception as e:
+                # Unwritten chunks stay pending; retry them on the next tick, not in a busy loop
+                next_flush = time.monotonic() + WRITER_FLUSH_INTERVAL
+                if kind == "flush" and not payload.done():
+                    payload.set_exception(e)
+                if self.on_error:
+                    self.on_error(f"❌ Write failed: {e}")
+
+    def write_pending(self):
+        pending, self.pending = self.pending, collections.defaultdict(list)
+        self.pending_count = 0
+        paths = list(pending)
+        for done, path in enumerate(paths):
+            # A chunk that fails to render would fail every time, so only it is dropped.
+            # Rendered chunks replace their callables in case the write is retried.
+            rendered = []
+            for chunk in pending[path]:
+                if callable(chunk):
+                    try:
+                        chunk = chunk()
+                    except Exception as e:
+                        if self.on_error:
+                            self.on_error(f"❌ Dropped output for {path} that failed to render: {e}")
+                        continue
+                rendered.append(chunk)
+            pending[path] = rendered
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                data = "".join(rendered).encode("utf-8")
+                with open(path, "ab") as f:
+                    f.write(data)
+            except Exception:
+                # I/O errors may clear up: put this file and the rest of the batch back,
+                # so a later flush or state file replace cannot get past data that
+                # never reached disk
+                for path in paths[done:]:
+                    self.pending[path] = pending[path]
+                    self.pending_count += len(pending[path])
+                raise
+            self.dirty.add(path)
+            if self.ledger:
+                self.ledger.add(path, len(data))
+
+    def notify_written(self, paths):
+        if self.on_written and paths:
+            self.on_written(paths)
+
+
+class S3Uploader:
+    # Uploads finished files in the background while the backup keeps running.
+    # Large files go up as parallel multipart uploads; objects whose stored sha256
+    # matches the local file are skipped.
+    def __init__(self, bucket, prefix="", endpoint_url=None, on_error=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.on_error = on_error
+        self.transfer = TransferConfig(multipart_threshold=S3_PART_SIZE, multipart_chunksize=S3_PART_SIZE,
+                                       max_concurrency=S3_PART_CONCURRENCY)
+        self.pool = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.uploading = set()
+        self.again = set()
+        self.futures = []
+        self.known = {}
+        self.failed = set(read_json(S3_FAILED_FILE, []))
+        self.submit_all([path for path in sorted(self.failed) if os.path.exists(path)])
+
+    def key_for(self, path):
+        return self.prefix + os.path.relpath(path).replace(os.sep, "/")
+
+    def submit(self, path):
+        # A file queued twice before its upload starts is only uploaded once; one
+        # submitted while it is uploading goes up again once that upload finishes
+        with self.lock:
+            if path in self.queued:
+                return
+            if path in self.uploading:
+                self.again.add(path)
+                return
+            self.queue_upload(path)
+
+    def queue_upload(self, path):
+        self.queued.add(path)
+        self.futures = [f for f in self.futures if not f.done()]
+        self.futures.append(self.pool.submit(self.upload, path))
+
+    def submit_all(self, paths):
+        for path in paths:
+            self.submit(path)
+
+    def upload(self, path):
+        with self.lock:
+            self.queued.discard(path)
+            self.uploading.add(path)
+        try:
+            for attempt in range(S3_UPLOAD_ATTEMPTS):
+                try:
+                    self.upload_once(path)
+                    self.set_failed(path, False)
+                    return
+                except FileNotFoundError:
+                    self.set_failed(path, False)
+                    return
+                except Exception as e:
+                    if attempt + 1 < S3_UPLOAD_ATTEMPTS:
+                        time.sleep(S3_RETRY_BASE_DELAY * 2 ** attempt)
+                        continue
+                    self.set_failed(path, True)
+                    if self.on_error:
+                        self.on_error(f"❌ Upload failed for {path}, will retry next run: {e}")
+        finally:
+            with self.lock:
+                self.uploading.discard(path)
+                if path in self.again:
+                    self.again.discard(path)
+                    self.queue_upload(path)
+
+    def upload_once(self, path):
+        before = os.stat(path)
+        digest = file_sha256(path)
+        key = self.key_for(path)
+        if self.known.get(key) != digest and self.remote_sha256(key) != digest:
+            self.client.upload_file(path, self.bucket, key, Config=self.transfer,
+                                    ExtraArgs={"Metadata": {"sha256": digest}})
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            # Appended to while hashing or uploading, so the object may not match
+            # its sha256; upload the file again
+            with self.lock:
+                self.again.add(path)
+        else:
+            self.known[key] = digest
+
+    def set_failed(self, path, failed):
+        with self.lock:
+            if (path in self.failed) == failed:
+                return
+            if failed:
+                self.failed.add(path)
+            else:
+                self.failed.discard(path)
+            write_atomic(S3_FAILED_FILE, json.dumps(sorted(self.failed)))
+
+    def remote_sha256(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["Metadata"].get("sha256")
+        except self.client.exceptions.ClientError:
+            return None
+
+    async def wait(self):
+        # Uploads that finish can queue one more, so wait until none are left
+        while True:
+            with self.lock:
+                futures = [f for f in self.futures if not f.done()]
+            if not futures:
+                return
+            for future in futures:
+                await asyncio.wrap_future(future)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_chat_id(key):
+    return key.lstrip("-").isdigit()
+
+
+def manifest_entry(media_path, message_id):
+    return json.dumps({
+        "file": os.path.basename(media_path),
+        "message_id": message_id,
+        "size": os.path.getsize(media_path),
+        "sha256": file_sha256(media_path),
+    }) + "\n"
+
+
+def load_manifest(chat_dir):
+    # Later lines win, so a re-fetched file replaces its earlier entry
+    entries = {}
+    path = os.path.join(chat_dir, MEDIA_MANIFEST)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["file"]] = entry
+    return entries
+
+
+def record_baseline(chat_dir):
+    # Media saved before manifests existed has nothing to compare against; its
+    # current size and hash become the reference for later checks
+    media_dir = os.path.join(chat_dir, "media")
+    lines = [manifest_entry(e.path, None) for e in os.scandir(media_dir) if e.is_file()]
+    with open(os.path.join(chat_dir, MEDIA_MANIFEST), "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+    return len(lines)
+
+
+def verify_backups(root="."):
+    # Only manifests are read, so the media trees are never walked, except once for
+    # chat folders from before manifests. Files whose size and mtime match the
+    # cache are not hashed again.
+    cache = {}
+    if os.path.exists(VERIFY_CACHE_FILE):
+        with open(VERIFY_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+
+    checks = []
+    unrecorded = []
+    for backup in sorted(os.scandir(root), key=lambda e: e.name):
+        if not (backup.is_dir() and backup.name.startswith("backup_")):
+            continue
+        for chat_dir in os.scandir(backup.path):
+            if not chat_dir.is_dir():
+                continue
+            if os.path.exists(os.path.join(chat_dir.path, MEDIA_MANIFEST)):
+                checks.extend((chat_dir.path, entry) for entry in load_manifest(chat_dir.path).values())
+            elif os.path.isdir(os.path.join(chat_dir.path, "media")):
+                unrecorded.append(chat_dir.path)
+
+    def check(chat_dir, entry):
+        path = os.path.join(chat_dir, "media", entry["file"])
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return path, "missing", None
+        if st.st_size != entry["size"]:
+            return path, "corrupt", None
+        cached = cache.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = file_sha256(path)
+        return path, ("ok" if digest == entry["sha256"] else "corrupt"), [st.st_size, st.st_mtime_ns, digest]
+
+    damaged = []
+    new_cache = {}
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify") as pool:
+        baselined = sum(pool.map(record_baseline, unrecorded))
+        results = pool.map(lambda c: check(*c), checks)
+        for (chat_dir, entry), (path, status, cache_entry) in zip(checks, results):
+            if cache_entry:
+                new_cache[path] = cache_entry
+            if status != "ok":
+                damaged.append({"folder": chat_dir, "file": entry["file"],
+                                "message_id": entry["message_id"], "problem": status})
+
+    with open(VERIFY_CACHE_FILE, "w") as f:
+        json.dump(new_cache, f)
+    with open(VERIFY_REPORT_FILE, "w") as f:
+        json.dump(damaged, f, indent=2)
+    return len(checks), damaged, baselined
+
 
 class TelegramBackupApp:
     def __init__(self, root):
@@ -35,24 +1191,106 @@ class TelegramBackupApp:
         self.chat_listbox = tk.Listbox(root, selectmode=tk.MULTIPLE, height=10, exportselection=False)
         self.chat_listbox.grid(row=3, column=1, sticky="ew")
 
+        self.backfill_var = tk.BooleanVar(value=True)
+        self.backfill_check = tk.Checkbutton(root, text="Backfill full history (takeout)", variable=self.backfill_var)
+        self.backfill_check.grid(row=3, column=2, columnspan=2, sticky="nw")
+
+        self.profile_var = tk.BooleanVar(value=False)
+        self.profile_check = tk.Checkbutton(root, text="Profile backup runs", variable=self.profile_var)
+        self.profile_check.grid(row=3, column=2, columnspan=2, sticky="sw")
+
         self.status_text = tk.Text(root, height=15, width=70)
-        self.status_text.grid(row=5, column=0, columnspan=3, pady=10)
+        self.status_text.grid(row=5, column=0, columnspan=4, pady=10)
 
         self.login_button = tk.Button(root, text="Login & Load Chats", command=self.login)
+        self.plan_button = tk.Button(root, text="Plan Backup", command=self.plan_job, state="disabled")
         self.start_button = tk.Button(root, text="Start Daily Backup", command=self.start_scheduler, state="disabled")
         self.stop_button = tk.Button(root, text="Stop Scheduler", command=self.stop_scheduler, state="disabled")
 
         self.login_button.grid(row=4, column=0, pady=5)
         self.start_button.grid(row=4, column=1)
         self.stop_button.grid(row=4, column=2)
+        self.plan_button.grid(row=4, column=3)
+
+        self.live_button = tk.Button(root, text="Start Live Backup", command=self.toggle_live, state="disabled")
+        self.live_button.grid(row=6, column=0, pady=5)
+        self.verify_button = tk.Button(root, text="Verify Backups", command=self.verify_job)
+        self.verify_button.grid(row=6, column=1)
 
         self.client = None
+        self.me_id = None
+        self.chats = {}
+        self.chat_order = []
         self.scheduler_thread = None
         self.running = False
+        self.live = False
+        self.live_chats = set()
+        self.live_seen = collections.defaultdict(set)
+        self.live_checkpoints = {}
+        self.live_owners = {}
+        self.live_events = []
+        self.live_handlers = []
+        self.live_tasks = []
         self.loop = asyncio.new_event_loop()
+        self.backfill_lock = asyncio.Lock()
+        self.live_flush_needed = asyncio.Event()
+        self.exporters = []
+        for name in EXPORT_FORMATS.split(","):
+            if name.strip() in EXPORTERS:
+                self.exporters.append(EXPORTERS[name.strip()]())
+            else:
+                self.log(f"⚠️ Unknown export format: {name}")
+        if not self.exporters:
+            # Never download media and move checkpoints without writing any pages
+            self.log("⚠️ No valid EXPORT_FORMATS configured, writing html.")
+            self.exporters.append(HtmlExporter())
+        # Created on the first backup run, so boto3 stays off the startup path
+        self.uploader = None
+        self.uploader_lock = asyncio.Lock()
+        self.uploader_failed = False
+        self.retries = MediaRetryQueue()
+        self.retry_task = None
+        self.ledger = SizeLedger()
+        self.archives = {} if OUTPUT_MODE == "archive" else None
+        self.checkpoints = ArchiveCheckpoints(self.archives) if self.archives is not None else None
+        self.archive_records = JsonlExporter()
+        self.writer = DiskWriter(on_error=self.log,
+                                 on_written=self.upload_paths,
+                                 ledger=self.ledger)
 
-        self.loop_thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.connected = asyncio.Event()
+        self.session_checked = False
+
+        self.loop_thread = threading.Thread(target=self.run_loop, name="event-loop", daemon=True)
         self.loop_thread.start()
+        self.load_cached_state()
+
+    def upload_paths(self, paths):
+        if self.uploader:
+            self.uploader.submit_all(paths)
+
+    async def ensure_uploader(self):
+        if not S3_BUCKET or self.uploader or self.uploader_failed:
+            return
+        async with self.uploader_lock:
+            if self.uploader or self.uploader_failed:
+                return
+            try:
+                self.uploader = await self.loop.run_in_executor(None, functools.partial(
+                    S3Uploader, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, on_error=self.log))
+            except ImportError:
+                self.uploader_failed = True
+                self.log("⚠️ S3_BUCKET is set but boto3 is not installed, backups stay local only.")
+
+    def submit(self, coro):
+        # Errors from UI-started jobs are logged; nothing else reads these futures
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self.log_job_error)
+        return future
+
+    def log_job_error(self, future):
+        if not future.cancelled() and future.exception():
+            self.log(f"❌ {future.exception()!r}")
 
     def run_loop(self):
         asyncio.set_event_loop(self.loop)
@@ -85,11 +1323,75 @@ class TelegramBackupApp:
             messagebox.showerror("Error", "API ID must be a number.")
             return
 
-        self.client = TelegramClient('telegram_backup_session', api_id, api_hash, loop=self.loop)
-        asyncio.run_coroutine_threadsafe(self._login(phone), self.loop)
+        asyncio.run_coroutine_threadsafe(self._login(api_id, api_hash, phone), self.loop)
+
+    def load_cached_state(self):
+        # Chats and credentials from the last login are shown straight away; the
+        # saved session is reconnected in the background without any other requests
+        config = read_json(APP_CONFIG_FILE, {})
+        for entry, key in [(self.api_id_entry, "api_id"), (self.api_hash_entry, "api_hash"), (self.phone_entry, "phone")]:
+            if config.get(key):
+                entry.insert(0, str(config[key]))
+        self.me_id = config.get("me_id")
+        self.chats = {c["id"]: CachedChat(c["id"], c["name"]) for c in read_json(CHATS_CACHE_FILE, [])}
+        self.show_chats()
+
+        if self.chats and config.get("api_id") and os.path.exists(SESSION_NAME + ".session"):
+            asyncio.run_coroutine_threadsafe(self.resume_session(config["api_id"], config["api_hash"]), self.loop)
+
+    async def resume_session(self, api_id, api_hash):
+        from telethon import TelegramClient
+
+        try:
+            self.client = TelegramClient(SESSION_NAME, api_id, api_hash, loop=self.loop)
+            await self.client.connect()
+        except Exception as e:
+            self.log(f"Could not resume saved session, please log in: {e}")
+            return
+        # Authorization is checked by the first job that needs the session
+        self.session_checked = False
+        self.connected.set()
+        if not self.retry_task:
+            self.retry_task = asyncio.ensure_future(self.retry_worker())
+        self.log(f"✅ Resumed saved session with {len(self.chats)} cached chats.")
+
+    async def check_session(self):
+        if self.session_checked:
+            return True
+        if not await self.client.is_user_authorized():
+            self.connected.clear()
+            self.log("⚠️ The saved session is no longer authorized, please log in again.")
+            return False
+        self.session_checked = True
+        return True
+
+    def show_chats(self):
+        # Chats are identified by peer id; duplicate names get the id appended
+        name_counts = collections.Counter(d.name for d in self.chats.values())
+        self.chat_order = sorted(self.chats, key=lambda chat_id: self.chats[chat_id].name)
+        self.chat_listbox.delete(0, tk.END)
+        for chat_id in self.chat_order:
+            name = self.chats[chat_id].name
+            self.chat_listbox.insert(tk.END, name if name_counts[name] == 1 else f"{name} ({chat_id})")
+        state = "normal" if self.chats else "disabled"
+        self.start_button.config(state=state)
+        self.plan_button.config(state=state)
+        self.live_button.config(state=state)
+
+    def require_connection(self):
+        if not self.connected.is_set():
+            self.log("⚠️ Not connected to Telegram yet, press Login & Load Chats.")
+            return False
+        return True
+
+    async def _login(self, api_id, api_hash, phone):
+        from telethon import TelegramClient
+        from telethon.errors import SessionPasswordNeededError
 
-    async def _login(self, phone):
         try:
+            if self.client:
+                await self.client.disconnect()
+            self.client = TelegramClient(SESSION_NAME, api_id, api_hash, loop=self.loop)
             await self.client.connect()
             if not await self.client.is_user_authorized():
                 self.log("Sending code request...")
@@ -110,21 +1412,28 @@ class TelegramBackupApp:
                         return
                     await self.client.sign_in(password=password)
 
-            self.me = await self.client.get_me()
+            me = await self.client.get_me()
+            self.me_id = me.id
+            self.session_checked = True
+            self.connected.set()
+            if not self.retry_task:
+                self.retry_task = asyncio.ensure_future(self.retry_worker())
             self.log("✅ Logged in successfully.")
             dialogs = await self.client.get_dialogs()
-            chat_names = sorted([d.name for d in dialogs if d.name])
-            self.dialogs = dialogs
-            self.chat_listbox.delete(0, tk.END)
-            for name in chat_names:
-                self.chat_listbox.insert(tk.END, name)
-            self.start_button.config(state="normal")
+            self.chats = {d.id: d for d in dialogs if d.name}
+            await self.migrate_name_keyed_state()
+            self.show_chats()
+
+            await self.writer.replace(APP_CONFIG_FILE, json.dumps(
+                {"api_id": api_id, "api_hash": api_hash, "phone": phone, "me_id": self.me_id}), upload=False)
+            await self.writer.replace(CHATS_CACHE_FILE, json.dumps(
+                [{"id": chat_id, "name": self.chats[chat_id].name} for chat_id in self.chat_order]), upload=False)
 
         except Exception as e:
             self.log(f"Login failed: {e}")
 
     def get_selected_chats(self):
-        return [self.chat_listbox.get(i) for i in self.chat_listbox.curselection()]
+        return [self.chat_order[i] for i in self.chat_listbox.curselection()]
 
     def load_last_ids(self):
         if os.path.exists(LAST_IDS_FILE):
@@ -132,213 +1441,923 @@ class TelegramBackupApp:
                 return json.load(f)
         return {}
 
-    def save_last_ids(self, data):
-        with open(LAST_IDS_FILE, "w") as f:
-            json.dump(data, f)
+    async def save_last_ids(self, data):
+        if self.checkpoints:
+            await self.writer.call(functools.partial(self.checkpoints.update, dict(data)))
+        else:
+            await self.writer.replace(LAST_IDS_FILE, json.dumps(data))
+
+    def load_stats(self):
+        if os.path.exists(STATS_FILE):
+            with open(STATS_FILE, "r") as f:
+                return json.load(f)
+        return {}
+
+    async def save_stats(self, data):
+        await self.writer.replace(STATS_FILE, json.dumps(data))
+
+    async def record_run_time(self, stats, predicted, elapsed):
+        # Keep a smoothed ratio of real to predicted time to correct future ETAs
+        if predicted <= 0:
+            return
+        scale = stats.get("eta_scale", 1.0)
+        stats["eta_scale"] = 0.5 * scale + 0.5 * (elapsed / predicted)
+        await self.save_stats(stats)
+
+    def find_chat(self, chat_id):
+        dialog = self.chats.get(chat_id)
+        return dialog.entity if dialog else None
+
+    def chat_title(self, chat_id):
+        dialog = self.chats.get(chat_id)
+        return dialog.name if dialog else str(chat_id)
+
+    async def migrate_name_keyed_state(self):
+        # Checkpoints and folders used to be keyed by display name, so a rename
+        # lost the checkpoint. Move them to peer ids once; ambiguous names stay put.
+        ids_by_name = collections.defaultdict(list)
+        for chat_id, dialog in self.chats.items():
+            ids_by_name[dialog.name].append(chat_id)
+
+        def migrate():
+            last_ids = self.load_last_ids()
+            changed = False
+            for key in [k for k in last_ids if not is_chat_id(k)]:
+                ids = ids_by_name.get(key, [])
+                if len(ids) != 1:
+                    self.log(f"⚠️ Could not migrate checkpoint for '{key}' ({len(ids)} chats with that name).")
+                    continue
+                last_ids.setdefault(str(ids[0]), last_ids[key])
+                del last_ids[key]
+                changed = True
+
+            ids_by_folder = collections.defaultdict(list)
+            for name, ids in ids_by_name.items():
+                ids_by_folder[name.replace(" ", "_")].extend(ids)
+            for backup in os.scandir("."):
+                if not (backup.is_dir() and backup.name.startswith("backup_")):
+                    continue
+                for folder in os.scandir(backup.path):
+                    ids = ids_by_folder.get(folder.name, [])
+                    if not folder.is_dir() or is_chat_id(folder.name) or len(ids) != 1:
+                        continue
+                    new_path = os.path.join(backup.path, str(ids[0]))
+                    if os.path.exists(new_path):
+                        self.log(f"⚠️ Not migrating {folder.path}: {new_path} already exists.")
+                        continue
+                    os.rename(folder.path, new_path)
+                    changed = True
+            return last_ids, changed
+
+        last_ids, changed = await self.loop.run_in_executor(None, migrate)
+        if changed:
+            await self.save_last_ids(last_ids)
+            await self.writer.flush()
+            self.log("🔁 Migrated name-keyed checkpoints and folders to chat ids.")
+
+    async def estimate_chat(self, chat_id, target, last_msg_id, backfill):
+        # Only message metadata is fetched here, media sizes come from the file info
+        sample = compact(await self.client.get_messages(target, min_id=last_msg_id, limit=PLAN_SAMPLE_SIZE))
+        plan = ChatPlan(chat_id, self.chat_title(chat_id), target)
+        if not sample:
+            return plan
+
+        plan.top_id = sample[0].id
+        if len(sample) < PLAN_SAMPLE_SIZE:
+            plan.new_messages = len(sample)
+        elif has_own_id_sequence(chat_id):
+            plan.new_messages = max(plan.top_id - last_msg_id, len(sample))
+            plan.needs_backfill = plan.new_messages > FETCH_LIMIT
+        elif backfill:
+            # The id gap says nothing here, so probe for a message past FETCH_LIMIT;
+            # the history total bounds the count when there is one
+            probe = await self.client.get_messages(target, min_id=last_msg_id, limit=1, add_offset=FETCH_LIMIT)
+            plan.needs_backfill = bool(probe)
+            if probe:
+                plan.new_messages = max(min(plan.top_id - last_msg_id, probe.total), FETCH_LIMIT + 1)
+            else:
+                plan.new_messages = FETCH_LIMIT
+        else:
+            plan.new_messages = FETCH_LIMIT
+        if not backfill:
+            plan.new_messages = min(plan.new_messages, FETCH_LIMIT)
+
+        media = [m for m in sample if m.media]
+        media_bytes = sum(m.media_size for m in media)
+        ratio = plan.new_messages / len(sample)
+        plan.media_count = round(len(media) * ratio)
+        plan.media_bytes = int(media_bytes * ratio)
+        return plan
+
+    async def plan_backup(self, selected_chats, last_ids, stats, backfill):
+        chat_ids = []
+        pending = []
+        for chat_id in selected_chats:
+            target = self.find_chat(chat_id)
+            if not target:
+                self.log(f"❌ Chat not found: {chat_id}")
+                continue
+            chat_ids.append(chat_id)
+            pending.append(self.estimate_chat(chat_id, target, last_ids.get(str(chat_id), 0), backfill))
+
+        # A chat that cannot be estimated (left, unresolvable, flood wait) is skipped
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        plans = []
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                self.log(f"❌ Skipping {self.chat_title(chat_id)}: {result}")
+            else:
+                plans.append(result)
+        plans.sort(key=lambda p: p.cost, reverse=True)
+        workers = min(BACKUP_WORKERS, len(plans))
+        makespan = estimate_makespan([p.cost for p in plans], workers)
+        eta = makespan * stats.get("eta_scale", 1.0)
+
+        self.log(f"🗺️ Backup plan ({workers} workers):")
+        for plan in plans:
+            self.log(f"   {plan.name}: ~{plan.new_messages} messages, ~{plan.media_count} media ({format_size(plan.media_bytes)})")
+        self.log(f"⏳ Estimated time: {datetime.timedelta(seconds=round(eta))}")
+        return plans, makespan
+
+    def plan_job(self):
+        selected_chats = self.get_selected_chats()
+        if not selected_chats:
+            self.log("⚠️ No chats selected for backup.")
+            return
+        if not self.require_connection():
+            return
+        self.submit(self.plan_only(selected_chats, self.backfill_var.get()))
+
+    async def plan_only(self, selected_chats, backfill):
+        if await self.check_session():
+            await self.plan_backup(selected_chats, self.load_last_ids(), self.load_stats(), backfill)
 
     def backup_job(self):
-        asyncio.run_coroutine_threadsafe(self.backup_chats(), self.loop)
+        self.submit(self.backup_chats())
 
     async def backup_chats(self):
         selected_chats = self.get_selected_chats()
         if not selected_chats:
             self.log("⚠️ No chats selected for backup.")
             return
+        if not self.require_connection() or not await self.check_session():
+            return
+        await self.ensure_uploader()
 
-        date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-        last_ids = self.load_last_ids()
+        run_started = datetime.datetime.now()
+        date_str = run_started.strftime("%Y-%m-%d")
+        profiler = RunProfiler(self.loop) if self.profile_var.get() else None
+        if profiler:
+            profiler.start()
+        try:
+            plans, total_texts, total_media = await self.run_backup(selected_chats, date_str)
+        finally:
+            if profiler:
+                profiler.stop()
+        await self.write_run_report(date_str, run_started, plans, total_texts, total_media, profiler)
+        await self.apply_retention()
+        self.log(f"📦 Backup complete: {total_texts} messages, {total_media} media files saved.\n")
+
+    async def apply_retention(self):
+        if RETENTION_KEEP_DAYS or RETENTION_MAX_CHAT_BYTES:
+            removed, freed = await self.loop.run_in_executor(
+                None, prune_backups, self.ledger, datetime.date.today())
+            if removed:
+                await self.writer.flush()
+                self.log(f"🧹 Retention removed {removed} chat folders, freeing {format_size(freed)}.")
+        totals = self.ledger.totals()
+        breakdown = ", ".join(f"{kind} {format_size(size)}" for kind, size in totals.most_common())
+        self.log(f"💾 Backups use {format_size(sum(totals.values()))} ({breakdown or 'nothing recorded yet'}).")
+
+    async def write_run_report(self, date_str, run_started, plans, total_texts, total_media, profiler):
+        base = os.path.join(f"backup_{date_str}", "reports", f"run_{run_started.strftime('%H%M%S')}")
+        report = {
+            "started": run_started.isoformat(),
+            "elapsed": (datetime.datetime.now() - run_started).total_seconds(),
+            "chats": [{"id": plan.chat_id, "name": plan.name} for plan in plans],
+            "messages": total_texts,
+            "media": total_media,
+        }
+        if profiler:
+            # Folded stacks load straight into flamegraph.pl or speedscope
+            await self.writer.replace(base + ".folded", profiler.folded_stacks())
+            await self.writer.replace(base + "_tasks.json", json.dumps(profiler.task_timings(), indent=2))
+            report["profile"] = {"stacks": base + ".folded", "tasks": base + "_tasks.json",
+                                 "samples": profiler.samples}
+            self.log(f"🔬 Profile written to {base}.folded")
+        await self.writer.replace(base + ".json", json.dumps(report, indent=2))
+        await self.writer.flush()
+
+    async def run_backup(self, selected_chats, date_str):
+        last_ids = await self.loop.run_in_executor(None, self.load_last_ids)
+        stats = await self.loop.run_in_executor(None, self.load_stats)
+        backfill = self.backfill_var.get()
         total_texts = 0
         total_media = 0
 
-        for chat_name in selected_chats:
-            self.log(f"🔄 Backing up chat: {chat_name}")
-            target = next((d.entity for d in self.dialogs if d.name == chat_name), None)
-            if not target:
-                self.log(f"❌ Chat not found: {chat_name}")
+        # Largest chats first: each idle worker takes the next most expensive chat
+        plans, makespan = await self.plan_backup(selected_chats, last_ids, stats, backfill)
+        work = asyncio.Queue()
+        for plan in plans:
+            work.put_nowait(plan)
+
+        async def worker():
+            nonlocal total_texts, total_media
+            while not work.empty():
+                plan = work.get_nowait()
+                # One failing chat must not stop the others or the checkpoint save
+                try:
+                    if backfill and plan.needs_backfill:
+                        texts, media = await self.backfill_chat(plan.chat_id, plan.target, plan.top_id, date_str, last_ids)
+                    else:
+                        texts, media = await self.backup_chat(plan.chat_id, plan.target, date_str, last_ids)
+                except Exception as e:
+                    self.log(f"❌ Backup of {plan.name} failed: {e}")
+                    continue
+                total_texts += texts
+                total_media += media
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(min(BACKUP_WORKERS, len(plans)))))
+
+        # Close all open HTML containers for all chats (optional but neat)
+        for plan in plans:
+            await self.close_chat_files(plan.chat_id, date_str)
+
+        await self.save_last_ids(last_ids)
+        await self.save_retries()
+        await self.record_run_time(stats, makespan, time.monotonic() - started)
+        await self.writer.flush()
+        if self.uploader:
+            await self.uploader.wait()
+        return plans, total_texts, total_media
+
+    def chat_folder(self, chat_id, date_str):
+        return os.path.join(f"backup_{date_str}", str(chat_id))
+
+    async def prepare_chat_files(self, chat_id, date_str):
+        if self.archives is not None:
+            # Media is staged next to the archive until it is added to the segment
+            folder = self.chat_archive(chat_id).staging
+            await self.loop.run_in_executor(None, functools.partial(os.makedirs, folder, exist_ok=True))
+            return folder
+
+        folder = self.chat_folder(chat_id, date_str)
+        # The media folder must exist before download_media writes into it
+        await self.loop.run_in_executor(
+            None, functools.partial(os.makedirs, os.path.join(folder, "media"), exist_ok=True))
+
+        # Create each export file with its header if new
+        for exporter in self.exporters:
+            await self.writer.create(os.path.join(folder, exporter.filename), exporter.header(self.chat_title(chat_id)))
+        return folder
+
+    async def close_chat_files(self, chat_id, date_str):
+        if self.archives is not None:
+            await self.finish_segment(chat_id)
+            return
+        folder = self.chat_folder(chat_id, date_str)
+        for exporter in self.exporters:
+            footer = exporter.footer()
+            if footer:
+                await self.writer.append(os.path.join(folder, exporter.filename), footer)
+
+    async def write_messages(self, chat_id, folder, messages, edited=False):
+        # Media is downloaded once and every exporter renders from the same record.
+        # Album items are downloaded together and rendered as a single bubble.
+        # Returns the number of media files saved.
+        saved = 0
+        for _, group in itertools.groupby(messages, key=album_key):
+            group = list(group)
+            from_me = group[0].sender_id == self.me_id
+            sender_name = "You" if from_me else (str(group[0].sender_id) if group[0].sender_id else "Unknown")
+            if self.archives is not None:
+                saved += await self.archive_messages(chat_id, folder, group, sender_name, from_me, edited)
                 continue
+            filenames = await asyncio.gather(*(self.download_record_media(chat_id, folder, msg) for msg in group))
+            saved += sum(1 for f in filenames if f)
 
-            folder = os.path.join(f"backup_{date_str}", chat_name.replace(" ", "_"))
-            os.makedirs(os.path.join(folder, "media"), exist_ok=True)
-            text_file = os.path.join(folder, "messages.html")
+            for exporter in self.exporters:
+                if len(group) == 1:
+                    chunk = functools.partial(exporter.render, group[0], sender_name, from_me, filenames[0], edited)
+                else:
+                    chunk = functools.partial(exporter.render_album, group, sender_name, from_me, filenames, edited)
+                await self.writer.append(os.path.join(folder, exporter.filename), chunk)
+        return saved
 
-            # Create file with header + CSS if new
-            if not os.path.exists(text_file):
-                with open(text_file, "w", encoding="utf-8") as f:
-                    f.write(f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8" />
-<meta name="viewport" content="width=device-width, initial-scale=1" />
-<title>Telegram Backup - {chat_name}</title>
-<style>
-  body {{
-    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    background: #f5f8fa;
-    padding: 20px;
-  }}
-  .chat-container {{
-    max-width: 600px;
-    margin: auto;
-    background: white;
-    border-radius: 8px;
-    padding: 15px;
-    box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-  }}
-  .message {{
-    margin: 10px 0;
-    max-width: 70%;
-    padding: 10px 15px;
-    border-radius: 18px;
-    clear: both;
-    position: relative;
-    font-size: 14px;
-    line-height: 1.3;
-  }}
-  .from-me {{
-    background-color: #dcf8c6;
-    float: right;
-    text-align: right;
-  }}
-  .from-others {{
-    background-color: #fff;
-    border: 1px solid #e2e2e2;
-    float: left;
-    text-align: left;
-  }}
-  .sender {{
-    font-weight: bold;
-    font-size: 13px;
-    margin-bottom: 3px;
-  }}
-  .timestamp {{
-    font-size: 11px;
-    color: #888;
-    margin-top: 5px;
-  }}
-  img.media, video.media {{
-    max-width: 100%;
-    border-radius: 10px;
-    margin-top: 5px;
-  }}
-  .document-preview {{
-    display: flex;
-    align-items: center;
-    margin-top: 5px;
-  }}
-  .doc-icon {{
-    width: 24px;
-    height: 24px;
-    margin-right: 8px;
-    opacity: 0.7;
-  }}
-  a {{
-    color: #065fd4;
-    text-decoration: none;
-  }}
-  a:hover {{
-    text-decoration: underline;
-  }}
-</style>
-</head>
-<body>
-<div class="chat-container">
-""")
+    async def write_refetched(self, chat_id, folder, messages):
+        # Retried media is added as a note on the message already written with a
+        # placeholder, not as a second copy of that message
+        if self.archives is not None:
+            # Later index entries win, so the archive just gets the complete record
+            await self.write_messages(chat_id, folder, messages)
+            return
+        filenames = await asyncio.gather(*(self.download_record_media(chat_id, folder, msg) for msg in messages))
+        for exporter in self.exporters:
+            chunk = "".join(exporter.render_refetch(msg, f) for msg, f in zip(messages, filenames) if f)
+            if chunk:
+                await self.writer.append(os.path.join(folder, exporter.filename), chunk)
+
+    def chat_archive(self, chat_id):
+        if chat_id not in self.archives:
+            self.archives[chat_id] = ChatArchive(
+                chat_id, on_closed=self.archive_closed)
+        return self.archives[chat_id]
+
+    async def archive_messages(self, chat_id, staging, group, sender_name, from_me, edited):
+        archive = self.chat_archive(chat_id)
+        paths = await asyncio.gather(*(self.download_media_file(chat_id, staging, staging, msg) for msg in group))
+        for msg, path in zip(group, paths):
+            filename = f"{msg.id}_{os.path.basename(path)}" if path else path
+            line = self.archive_records.render(msg, sender_name, from_me, filename, edited)
+            await self.writer.call(functools.partial(archive.add, msg.id, line, path))
+        return sum(1 for path in paths if path)
+
+    def archive_closed(self, chat_id, paths):
+        self.checkpoints.segment_closed(chat_id)
+        self.upload_paths(paths)
+
+    async def finish_segment(self, chat_id):
+        if self.archives is not None and chat_id in self.archives:
+            await self.writer.call(self.archives[chat_id].close)
+
+    async def roll_segments(self):
+        # Live mode keeps segments open across flushes; quiet chats still close on age
+        if self.archives is not None:
+            for archive in list(self.archives.values()):
+                await self.writer.call(archive.close_if_due)
 
-            last_msg_id = last_ids.get(chat_name, 0)
-            messages = await self.client.get_messages(target, min_id=last_msg_id, limit=200)
-            messages = list(reversed(messages))
+    async def download_media_file(self, chat_id, folder, file, msg, repair=False):
+        from telethon.errors import RPCError
+
+        if not msg.media:
+            return None
+        try:
+            media_path = await self.client.download_media(msg.source or msg.media, file=file)
+        except (RPCError, ConnectionError, asyncio.TimeoutError) as e:
+            # Usually an expired file reference; the retry worker refetches the message
+            self.retries.add(chat_id, folder, msg.id, e, file=file if repair else None)
+            self.log(f"⚠️ Media of message {msg.id} failed ({e}), queued for retry.")
+            return MEDIA_PENDING
+        self.retries.discard(chat_id, msg.id)
+        return media_path
+
+    async def download_record_media(self, chat_id, folder, msg):
+        media_path = await self.download_media_file(chat_id, folder, os.path.join(folder, "media"), msg)
+        if not media_path:
+            # None when there is nothing to download (link previews, polls, locations)
+            return media_path
+        await self.record_media(folder, media_path, msg.id)
+        return os.path.basename(media_path)
+
+    async def record_media(self, folder, media_path, message_id):
+        # Hashed here rather than on the writer thread, where a vanished file would
+        # fail the whole batch
+        try:
+            entry = await self.loop.run_in_executor(None, manifest_entry, media_path, message_id)
+        except OSError as e:
+            self.log(f"⚠️ Could not record {media_path} in the manifest: {e}")
+            return
+        await self.writer.append(os.path.join(folder, MEDIA_MANIFEST), entry)
+        await self.writer.account(media_path)
+        if self.uploader:
+            self.uploader.submit(media_path)
+
+    async def write_deletions(self, chat_id, folder, deleted_ids):
+        if self.archives is not None:
+            for msg_id in deleted_ids:
+                line = self.archive_records.render_deletion(msg_id)
+                await self.writer.call(functools.partial(self.chat_archive(chat_id).add, msg_id, line))
+            return
+        for exporter in self.exporters:
+            chunk = "".join(exporter.render_deletion(msg_id) for msg_id in deleted_ids)
+            await self.writer.append(os.path.join(folder, exporter.filename), chunk)
 
+    async def backup_chat(self, chat_id, target, date_str, last_ids, claimed=None):
+        chat_name = self.chat_title(chat_id)
+        self.log(f"🔄 Backing up chat: {chat_name}")
+        folder = await self.prepare_chat_files(chat_id, date_str)
+
+        last_msg_id = last_ids.get(str(chat_id), 0)
+        messages = await self.client.get_messages(target, min_id=last_msg_id, limit=FETCH_LIMIT)
+        messages = compact(reversed(messages))
+
+        if not messages:
+            self.log(f"✅ No new messages for {chat_name}.")
+            return 0, 0
+
+        # The checkpoint only moves once every album in the batch is fully written
+        checkpoint = messages[-1].id
+        if claimed is not None:
+            # Shared with the live handlers: whoever claims an id first writes it
+            messages = [m for m in messages if m.id not in claimed]
+            claimed.update(m.id for m in messages)
+        media = await self.write_messages(chat_id, folder, messages)
+        last_ids[str(chat_id)] = checkpoint
+
+        await self.writer.flush()
+        self.log(f"✅ {len(messages)} messages backed up from '{chat_name}'.")
+        return len(messages), media
+
+    async def fetch_range(self, client, target, low_id, high_id):
+        return [MessageRecord.from_message(m)
+                async for m in client.iter_messages(target, min_id=low_id, max_id=high_id + 1, reverse=True)]
+
+    async def backfill_ranges(self, client, chat_id, target, top_id, folder, last_ids):
+        # Ranges are fetched concurrently but written strictly in id order, and the
+        # checkpoint advances after each one so an interrupted backfill resumes
+        bounds = collections.deque(
+            (low, min(low + BACKFILL_RANGE_SIZE, top_id))
+            for low in range(last_ids.get(str(chat_id), 0), top_id, BACKFILL_RANGE_SIZE)
+        )
+        in_flight = collections.deque()
+        carry = []
+        texts = 0
+        media = 0
+        try:
+            while bounds or in_flight:
+                while bounds and len(in_flight) < BACKFILL_CONCURRENCY:
+                    low, high = bounds.popleft()
+                    in_flight.append((high, asyncio.ensure_future(self.fetch_range(client, target, low, high))))
+
+                high, task = in_flight.popleft()
+                messages = carry + await task
+                carry = []
+                if bounds or in_flight:
+                    # An album cut by the range boundary is held back until the next range
+                    messages, carry = split_trailing_album(messages)
+                if messages:
+                    media += await self.write_messages(chat_id, folder, messages)
+                    texts += len(messages)
+                last_ids[str(chat_id)] = carry[0].id - 1 if carry else high
+                await self.save_last_ids(last_ids)
+                self.log(f"   {self.chat_title(chat_id)}: backfilled up to message {high} of {top_id}")
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+        return texts, media
+
+    async def backfill_pages(self, client, chat_id, target, top_id, folder, last_ids):
+        # Private chats and basic groups share ids across the account, so id windows
+        # would be mostly empty; their history is paged through in order instead
+        pending = []
+        texts = 0
+        media = 0
+
+        async def write(messages):
+            nonlocal texts, media
+            media += await self.write_messages(chat_id, folder, messages)
+            texts += len(messages)
+
+        async for msg in client.iter_messages(target, min_id=last_ids.get(str(chat_id), 0),
+                                              max_id=top_id + 1, reverse=True):
+            pending.append(MessageRecord.from_message(msg))
+            if len(pending) < FETCH_LIMIT:
+                continue
+            # An album cut by the batch boundary is held back until the next batch
+            messages, carry = split_trailing_album(pending)
             if not messages:
-                self.log(f"✅ No new messages for {chat_name}.")
                 continue
+            await write(messages)
+            pending = carry
+            last_ids[str(chat_id)] = messages[-1].id
+            await self.save_last_ids(last_ids)
+            self.log(f"   {self.chat_title(chat_id)}: backfilled up to message {messages[-1].id} of {top_id}")
+        if pending:
+            await write(pending)
+        last_ids[str(chat_id)] = top_id
+        await self.save_last_ids(last_ids)
+        return texts, media
 
-            with open(text_file, "a", encoding="utf-8") as f:
-                for msg in messages:
-                    sender_name = "You" if msg.sender_id == (self.me.id if self.me else None) else (str(msg.sender_id) if msg.sender_id else "Unknown")
-                    timestamp = msg.date.strftime("%Y-%m-%d %H:%M")
-                    text = msg.message or ""
-                    from_me_class = "from-me" if msg.sender_id == (self.me.id if self.me else None) else "from-others"
-                    media_html = ""
-
-                    if msg.media:
-                        media_path = await msg.download_media(file=os.path.join(folder, "media"))
-                        filename = os.path.basename(media_path)
-                        ext = os.path.splitext(filename)[1].lower()
-
-                        if ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-                            media_html = f'<img class="media" src="media/{filename}" alt="Image"/>'
-                        elif ext in [".mp4", ".mov", ".avi"]:
-                            media_html = f'<video class="media" controls><source src="media/{filename}" type="video/mp4">Your browser does not support the video tag.</video>'
-                        elif ext in [".pdf", ".doc", ".docx", ".xls", ".xlsx"]:
-                            doc_icon_svg = '''
-                                <svg class="doc-icon" fill="none" stroke="currentColor" stroke-width="2" viewBox="0 0 24 24" 
-                                     xmlns="http://www.w3.org/2000/svg" aria-hidden="true">
-                                  <path stroke-linecap="round" stroke-linejoin="round" d="M7 7v10a2 2 0 002 2h6a2 2 0 002-2V7H7z"/>
-                                  <path stroke-linecap="round" stroke-linejoin="round" d="M7 7l5 5 5-5"/>
-                                </svg>
-                            '''
-                            media_html = f'<div class="document-preview">{doc_icon_svg}<a href="media/{filename}" target="_blank" download>{filename}</a></div>'
-                        else:
-                            media_html = f'<a href="media/{filename}" target="_blank" download>Download {filename}</a>'
-
-                    # Escape text for HTML safety
-                    import html
-                    safe_text = html.escape(text).replace("\n", "<br>")
-
-                    f.write(f"""
-                    <div class="message {from_me_class}">
-                      <div class="sender">{sender_name}</div>
-                      <div class="text">{safe_text}</div>
-                      {media_html}
-                      <div class="timestamp">{timestamp}</div>
-                    </div>
-                    """)
-
-            last_ids[chat_name] = messages[-1].id
-            total_texts += len(messages)
-            total_media += sum(1 for m in messages if m.media)
-            self.log(f"✅ {len(messages)} messages backed up from '{chat_name}'.")
-
-        self.save_last_ids(last_ids)
+    async def backfill_chat(self, chat_id, target, top_id, date_str, last_ids):
+        from telethon.errors import TakeoutInitDelayError
 
-        # Close all open HTML containers for all chats (optional but neat)
-        for chat_name in selected_chats:
+        chat_name = self.chat_title(chat_id)
+        self.log(f"🚚 Backfilling history for chat: {chat_name}")
+        folder = await self.prepare_chat_files(chat_id, date_str)
+
+        backfill = self.backfill_ranges if has_own_id_sequence(chat_id) else self.backfill_pages
+
+        # One takeout session at a time; other workers keep running incremental chats
+        async with self.backfill_lock:
+            try:
+                async with self.client.takeout(finalize=True, users=True, chats=True, megagroups=True,
+                                               channels=True, files=True) as takeout:
+                    texts, media = await backfill(takeout, chat_id, target, top_id, folder, last_ids)
+            except TakeoutInitDelayError as e:
+                self.log(f"⚠️ Takeout not yet allowed (retry in {e.seconds}s), backfilling with the regular API.")
+                texts, media = await backfill(self.client, chat_id, target, top_id, folder, last_ids)
+
+        await self.writer.flush()
+        self.log(f"✅ {texts} messages backfilled from '{chat_name}'.")
+        return texts, media
+
+    def toggle_live(self):
+        if self.live:
+            self.submit(self.stop_live())
+            return
+        selected_chats = self.get_selected_chats()
+        if not selected_chats:
+            self.log("⚠️ No chats selected for backup.")
+            return
+        if not self.require_connection():
+            return
+        self.submit(self.start_live(selected_chats))
+
+    async def start_live(self, selected_chats):
+        from telethon import events
+
+        if not await self.check_session():
+            return
+        await self.ensure_uploader()
+        self.live = True
+        self.live_chats = set(selected_chats)
+        targets = [self.find_chat(chat_id) for chat_id in self.live_chats]
+        self.live_handlers = [
+            (self.on_live_message, events.NewMessage(chats=targets)),
+            (self.on_live_edit, events.MessageEdited(chats=targets)),
+            # Deletions in private chats and basic groups carry no chat, so a chat
+            # filter would drop them; they are matched to a chat in the handler
+            (self.on_live_delete, events.MessageDeleted()),
+        ]
+        for callback, event in self.live_handlers:
+            self.client.add_event_handler(callback, event)
+        self.live_tasks = [
+            asyncio.ensure_future(self.live_writer()),
+            asyncio.ensure_future(self.live_reconciler()),
+        ]
+        self.live_button.config(text="Stop Live Backup")
+        self.start_button.config(state="disabled")
+        self.log(f"📡 Live backup started for {len(self.live_chats)} chats.")
+
+    async def stop_live(self):
+        self.live = False
+        for callback, event in self.live_handlers:
+            self.client.remove_event_handler(callback, event)
+        self.live_handlers = []
+        for task in self.live_tasks:
+            task.cancel()
+        self.live_tasks = []
+        await self.flush_live_events()
+        for chat_id in self.live_chats:
+            await self.finish_segment(chat_id)
+        self.live_checkpoints = {}
+        self.live_owners = {}
+        await self.writer.flush()
+        self.live_button.config(text="Start Live Backup")
+        if not self.running:
+            self.start_button.config(state="normal")
+        self.log("🛑 Live backup stopped.")
+
+    def queue_live_event(self, kind, chat_id, item):
+        self.live_events.append((kind, chat_id, item))
+        if len(self.live_events) >= LIVE_BATCH_SIZE:
+            self.live_flush_needed.set()
+
+    async def on_live_message(self, event):
+        chat_id = event.chat_id
+        if chat_id not in self.live_chats:
+            return
+        msg_id = event.message.id
+        # Already written by the reconciliation poll, possibly before this update arrived
+        if msg_id in self.live_seen[chat_id] or msg_id <= self.live_checkpoints.get(chat_id, 0):
+            return
+        self.live_seen[chat_id].add(msg_id)
+        if not has_own_id_sequence(chat_id):
+            self.live_owners[msg_id] = chat_id
+        self.queue_live_event("new", chat_id, MessageRecord.from_message(event.message))
+
+    async def on_live_edit(self, event):
+        if event.chat_id in self.live_chats:
+            self.queue_live_event("edited", event.chat_id, MessageRecord.from_message(event.message))
+
+    async def on_live_delete(self, event):
+        if event.chat_id is not None:
+            if event.chat_id in self.live_chats:
+                self.queue_live_event("deleted", event.chat_id, event.deleted_ids)
+            return
+        # Telegram does not say which chat a deletion belongs to for private chats and
+        # basic groups; their ids are unique per account, so ids written this session
+        # map back to their chat
+        by_chat = collections.defaultdict(list)
+        for msg_id in event.deleted_ids:
+            if msg_id in self.live_owners:
+                by_chat[self.live_owners.pop(msg_id)].append(msg_id)
+        for chat_id, ids in by_chat.items():
+            self.queue_live_event("deleted", chat_id, ids)
+
+    async def flush_live_events(self):
+        self.live_flush_needed.clear()
+        if not self.live_events:
+            return
+        batch, self.live_events = self.live_events, []
+        date_str = datetime.datetime.now().strftime("%Y-%m-%d")
+
+        by_chat = collections.defaultdict(list)
+        for kind, chat_id, item in batch:
+            by_chat[chat_id].append((kind, item))
+
+        for chat_id, items in by_chat.items():
+            folder = await self.prepare_chat_files(chat_id, date_str)
+            for kind, group in itertools.groupby(items, key=lambda i: i[0]):
+                payload = [item for _, item in group]
+                if kind == "deleted":
+                    await self.write_deletions(chat_id, folder, [msg_id for ids in payload for msg_id in ids])
+                else:
+                    await self.write_messages(chat_id, folder, payload, edited=(kind == "edited"))
+        self.log(f"📝 Live: {len(batch)} events written.")
+
+    async def live_writer(self):
+        while self.live:
+            try:
+                await asyncio.wait_for(self.live_flush_needed.wait(), LIVE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush_live_events()
+            await self.roll_segments()
+
+    async def live_reconciler(self):
+        # Fills gaps left by disconnects; the first pass catches up since the last run
+        while self.live:
             date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-            folder = os.path.join(f"backup_{date_str}", chat_name.replace(" ", "_"))
-            text_file = os.path.join(folder, "messages.html")
-            # Append closing tags only if file exists
-            if os.path.exists(text_file):
-                with open(text_file, "a", encoding="utf-8") as f:
-                    f.write("</div></body></html>")
+            last_ids = await self.loop.run_in_executor(None, self.load_last_ids)
+            # Checkpoints held back while an archive segment is open are not on disk yet
+            for chat_id, checkpoint in self.live_checkpoints.items():
+                last_ids[str(chat_id)] = max(last_ids.get(str(chat_id), 0), checkpoint)
+            for chat_id in list(self.live_chats):
+                target = self.find_chat(chat_id)
+                if not target:
+                    continue
+                seen = self.live_seen[chat_id]
+                await self.backup_chat(chat_id, target, date_str, last_ids, claimed=seen)
+                checkpoint = last_ids.get(str(chat_id), 0)
+                if not has_own_id_sequence(chat_id):
+                    self.live_owners.update(dict.fromkeys(seen, chat_id))
+                # Late live updates at or below the checkpoint are dropped by on_live_message
+                self.live_checkpoints[chat_id] = checkpoint
+                self.live_seen[chat_id] = {msg_id for msg_id in seen if msg_id > checkpoint}
+            await self.save_last_ids(last_ids)
+            await asyncio.sleep(LIVE_RECONCILE_INTERVAL)
 
-        self.log(f"📦 Backup complete: {total_texts} messages, {total_media} media files saved.\n")
+    def verify_job(self):
+        self.submit(self.verify_and_repair())
+
+    async def verify_and_repair(self):
+        self.log("🔍 Verifying backed up media...")
+        await self.writer.flush()
+        checked, damaged, baselined = await self.loop.run_in_executor(None, verify_backups)
+        if baselined:
+            self.log(f"🔍 Recorded {baselined} older media files without a manifest; they are checked from the next run.")
+        self.log(f"🔍 {checked} media files checked, {len(damaged)} missing or corrupt.")
+        if not damaged:
+            return
+        for item in damaged:
+            self.log(f"   {item['problem']}: {os.path.join(item['folder'], 'media', item['file'])}")
+        if not self.connected.is_set() or not self.chats or not await self.check_session():
+            self.log(f"⚠️ Log in to re-fetch damaged media (details in {VERIFY_REPORT_FILE}).")
+            return
+        await self.ensure_uploader()
+        await self.refetch_media(damaged)
+
+    async def refetch_media(self, damaged):
+        by_folder = collections.defaultdict(list)
+        for item in damaged:
+            by_folder[item["folder"]].append(item)
+
+        repaired = 0
+        for folder, items in by_folder.items():
+            name = os.path.basename(folder)
+            chat_id = int(name) if is_chat_id(name) else None
+            target = self.find_chat(chat_id) if chat_id is not None else None
+            if not target:
+                self.log(f"❌ Chat not found for {folder}")
+                continue
+            # Baseline entries from before manifests have no message to re-fetch from
+            for item in items:
+                if item["message_id"] is None:
+                    self.log(f"⚠️ No message recorded for {item['file']}, it cannot be re-fetched.")
+            paths = {item["message_id"]: os.path.join(folder, "media", item["file"])
+                     for item in items if item["message_id"] is not None}
+            if not paths:
+                continue
+            try:
+                messages = await self.client.get_messages(target, ids=list(paths))
+            except Exception as e:
+                self.log(f"❌ Could not fetch messages for {folder}: {e}")
+                continue
+            await self.loop.run_in_executor(None, lambda: [os.remove(p) for p in paths.values() if os.path.exists(p)])
+            for msg in compact(m for m in messages if m):
+                if await self.repair_media(chat_id, folder, msg, paths[msg.id]):
+                    repaired += 1
+        await self.save_retries()
+        await self.writer.flush()
+        self.log(f"🔧 {repaired} of {len(damaged)} media files re-fetched.")
+
+    async def repair_media(self, chat_id, folder, msg, path):
+        # Downloaded under the damaged file's own name so pages and the manifest still
+        # point at it; failures go to the retry queue with that name
+        media_path = await self.download_media_file(chat_id, folder, path, msg, repair=True)
+        if not media_path:
+            return False
+        await self.record_media(folder, media_path, msg.id)
+        return True
+
+    async def save_retries(self):
+        await self.writer.replace(RETRY_FILE, self.retries.dump())
+
+    async def retry_worker(self):
+        # Runs beside the backups; failures only push an item's next attempt further out
+        while True:
+            await asyncio.sleep(RETRY_POLL_INTERVAL)
+            due = self.retries.due()
+            if not due or not self.connected.is_set():
+                continue
+            try:
+                if not await self.check_session():
+                    continue
+                await self.ensure_uploader()
+                await self.retry_media(due)
+            except Exception as e:
+                self.log(f"⚠️ Media retry pass failed: {e}")
+            await self.save_retries()
+
+    async def retry_media(self, due):
+        by_chat = collections.defaultdict(list)
+        repair_files = {}
+        for item in due:
+            by_chat[(item["chat_id"], item["folder"])].append(item["message_id"])
+            if item.get("file"):
+                repair_files[(item["chat_id"], item["message_id"])] = item["file"]
+
+        recovered = 0
+        for (chat_id, folder), ids in by_chat.items():
+            target = self.find_chat(chat_id)
+            if not target:
+                continue
+            for start in range(0, len(ids), RETRY_BATCH_SIZE):
+                batch = ids[start:start + RETRY_BATCH_SIZE]
+                # Refetching the parent messages gives fresh file references
+                fetched = await self.client.get_messages(target, ids=batch)
+                records = []
+                for msg_id, msg in zip(batch, fetched):
+                    if msg is None or not msg.media:
+                        self.retries.discard(chat_id, msg_id)
+                    else:
+                        records.append(MessageRecord.from_message(msg))
+                repairs = [r for r in records if (chat_id, r.id) in repair_files]
+                for msg in repairs:
+                    await self.repair_media(chat_id, folder, msg, repair_files[(chat_id, msg.id)])
+                await self.write_refetched(chat_id, folder, [r for r in records if r not in repairs])
+                recovered += sum(1 for r in records if f"{chat_id}:{r.id}" not in self.retries.items)
+        if recovered:
+            self.log(f"🔁 Recovered media for {recovered} messages.")
 
     def start_scheduler(self):
         if self.running:
             self.log("Scheduler already running.")
             return
+        import schedule
+
         self.running = True
         schedule.clear()
         schedule.every().day.at("16:42").do(self.backup_job)
         self.log("⏰ Daily backup scheduled for 16:42.")
         self.start_button.config(state="disabled")
         self.stop_button.config(state="normal")
-        self.scheduler_thread = threading.Thread(target=self.run_schedule, daemon=True)
+        self.live_button.config(state="disabled")
+        self.scheduler_thread = threading.Thread(target=self.run_schedule, name="scheduler", daemon=True)
         self.scheduler_thread.start()
 
     def stop_scheduler(self):
+        import schedule
+
         self.running = False
         schedule.clear()
         self.log("🛑 Scheduler stopped.")
         self.start_button.config(state="normal")
         self.stop_button.config(state="disabled")
+        self.live_button.config(state="normal")
 
     def run_schedule(self):
+        import schedule
+
         while self.running:
             schedule.run_pending()
             time.sleep(1)
 
+def benchmark_message_memory(count=20000):
+    # Compares holding a backlog of full Telethon messages against compact records
+    import tracemalloc
+    from telethon.tl import types
+    from telethon.tl.patched import Message
+
+    def make_message(i):
+        date = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i)
+        photo = types.Photo(id=i, access_hash=i, file_reference=os.urandom(32), date=date, dc_id=2,
+                            sizes=[types.PhotoSize(type="x", w=800, h=600, size=120000)])
+        return Message(id=i, peer_id=types.PeerUser(user_id=1), date=date,
+                       message=f"Message {i} with a link https://example.com/{i}",
+                       entities=[types.MessageEntityBold(offset=0, length=7),
+                                 types.MessageEntityUrl(offset=23, length=22)],
+                       media=types.MessageMediaPhoto(photo=photo) if i % 4 == 0 else None)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    raw = [make_message(i) for i in range(count)]
+    raw_bytes = tracemalloc.get_traced_memory()[0] - base
+    del raw
+
+    base = tracemalloc.get_traced_memory()[0]
+    records = [MessageRecord.from_message(make_message(i)) for i in range(count)]
+    record_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    print(f"{count} messages held as Telethon objects: {format_size(raw_bytes)}")
+    print(f"{len(records)} messages held as compact records: {format_size(record_bytes)}")
+    print(f"Reduction: {100 * (1 - record_bytes / raw_bytes):.0f}%")
+
+
+def benchmark_startup(runs=5):
+    # Each run is a fresh interpreter importing the app and building the window
+    import subprocess
+
+    code = ("import time; started = time.perf_counter(); "
+            "import tkinter as tk, sys, telegram_backup_v4 as app; "
+            "root = tk.Tk(); root.withdraw(); app.TelegramBackupApp(root); root.update(); "
+            "elapsed = time.perf_counter() - started; "
+            "heavy = [m for m in ('telethon', 'schedule', 'boto3') if m in sys.modules]; "
+            "print(elapsed, ','.join(heavy))")
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed, _, heavy = result.stdout.strip().partition(" ")
+        times.append(float(elapsed))
+        if heavy:
+            print(f"Heavy modules imported during startup: {heavy}")
+    best = min(times)
+    print(f"Startup to first window: best {best * 1000:.0f} ms, worst {max(times) * 1000:.0f} ms over {runs} runs")
+    return best <= STARTUP_BUDGET
+
+
+def check_s3_upload():
+    # Runs the uploader against the configured bucket, e.g. a local MinIO:
+    # S3_BUCKET=test S3_ENDPOINT_URL=http://localhost:9000 python telegram_backup_v4.py --check-s3
+    import tempfile
+
+    if not S3_BUCKET:
+        print("Set S3_BUCKET (and S3_ENDPOINT_URL for MinIO) to run the upload check.")
+        return False
+    errors = []
+    uploader = S3Uploader(S3_BUCKET, S3_PREFIX + "upload-check/", S3_ENDPOINT_URL, on_error=errors.append)
+
+    async def run(folder):
+        page = os.path.join(folder, "messages.html")
+        media = os.path.join(folder, "video.mp4")
+        with open(media, "wb") as f:
+            f.write(os.urandom(2 * S3_PART_SIZE + 1))
+        with open(page, "w") as f:
+            f.write("<html>")
+        uploader.submit_all([page, media, page])
+        # Appends while the first upload may still be running must still reach the bucket
+        for i in range(20):
+            with open(page, "a") as f:
+                f.write(f"<p>{i}</p>")
+            uploader.submit(page)
+        await uploader.wait()
+        for path in (page, media):
+            head = uploader.client.head_object(Bucket=uploader.bucket, Key=uploader.key_for(path))
+            stored = uploader.client.get_object(Bucket=uploader.bucket, Key=uploader.key_for(path))["Body"].read()
+            with open(path, "rb") as f:
+                local = f.read()
+            ok = stored == local and head["Metadata"].get("sha256") == hashlib.sha256(local).hexdigest()
+            print(f"{os.path.basename(path)}: {'ok' if ok else 'MISMATCH'} ({format_size(len(local))})")
+            if not ok:
+                errors.append(f"{path} does not match the uploaded object")
+
+    with tempfile.TemporaryDirectory(dir=".") as folder:
+        asyncio.run(run(folder))
+    for error in errors:
+        print(error)
+    return not errors
+
+
 if __name__ == "__main__":
+    if "--benchmark-memory" in sys.argv:
+        benchmark_message_memory()
+        sys.exit()
+    if "--benchmark-startup" in sys.argv:
+        sys.exit(0 if benchmark_startup() else 1)
+    if "--check-s3" in sys.argv:
+        sys.exit(0 if check_s3_upload() else 1)
+    if "--extract" in sys.argv:
+        # python telegram_backup_v4.py --extract CHAT_ID MESSAGE_ID
+        position = sys.argv.index("--extract")
+        record, media_path = extract_message(int(sys.argv[position + 1]), int(sys.argv[position + 2]))
+        print(json.dumps(record, indent=2, ensure_ascii=False) if record else "Message not found in archive.")
+        if media_path:
+            print(f"Media extracted to {media_path}")
+        sys.exit()
     root = tk.Tk()
     app = TelegramBackupApp(root)
     root.mainloop()
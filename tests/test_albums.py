@@ -0,0 +1,37 @@
+import datetime
+
+import telegram_backup_v4 as app
+
+
+def record(msg_id, grouped_id=None):
+    return app.MessageRecord(msg_id, datetime.datetime(2024, 1, 1), None, 1, "", grouped_id, None, 0)
+
+
+def ids(messages):
+    return [m.id for m in messages]
+
+
+def test_batch_without_trailing_album_is_kept_whole():
+    messages = [record(1), record(2, grouped_id=7), record(3, grouped_id=7), record(4)]
+    kept, carry = app.split_trailing_album(messages)
+    assert ids(kept) == [1, 2, 3, 4]
+    assert carry == []
+
+
+def test_trailing_album_is_carried():
+    messages = [record(1), record(2, grouped_id=7), record(3, grouped_id=8), record(4, grouped_id=8)]
+    kept, carry = app.split_trailing_album(messages)
+    assert ids(kept) == [1, 2]
+    assert ids(carry) == [3, 4]
+
+
+def test_batch_that_is_one_album_is_carried_entirely():
+    messages = [record(1, grouped_id=7), record(2, grouped_id=7)]
+    kept, carry = app.split_trailing_album(messages)
+    assert kept == []
+    assert ids(carry) == [1, 2]
+
+
+def test_album_key_groups_only_album_items():
+    assert app.album_key(record(1, grouped_id=7)) == app.album_key(record(2, grouped_id=7))
+    assert app.album_key(record(1)) != app.album_key(record(2))
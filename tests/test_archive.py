@@ -0,0 +1,98 @@
+import datetime
+import json
+import os
+
+import pytest
+
+import telegram_backup_v4 as app
+
+CHAT_ID = -1001234
+
+
+@pytest.fixture
+def archives(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return {}
+
+
+@pytest.fixture
+def checkpoints(archives):
+    return app.ArchiveCheckpoints(archives)
+
+
+@pytest.fixture
+def archive(archives, checkpoints):
+    chat_archive = app.ChatArchive(CHAT_ID, on_closed=lambda chat_id, paths: checkpoints.segment_closed(chat_id))
+    archives[CHAT_ID] = chat_archive
+    os.makedirs(chat_archive.staging)
+    return chat_archive
+
+
+def line(msg_id, text, edited=False):
+    msg = app.MessageRecord(msg_id, datetime.datetime(2024, 1, 1), None, 1, text, None, None, 0)
+    return app.JsonlExporter().render(msg, "Alice", False, None, edited)
+
+
+def saved_checkpoints():
+    with open(app.LAST_IDS_FILE) as f:
+        return json.load(f)
+
+
+def test_checkpoint_is_held_while_the_segment_is_open(archive, checkpoints):
+    archive.add(1, line(1, "one"))
+    checkpoints.update({str(CHAT_ID): 1, "555": 9})
+    assert saved_checkpoints() == {"555": 9}
+
+    archive.close()
+    assert saved_checkpoints() == {"555": 9, str(CHAT_ID): 1}
+
+
+def test_held_checkpoint_keeps_the_last_saved_value(archive, checkpoints):
+    checkpoints.update({str(CHAT_ID): 5})
+    archive.add(6, line(6, "six"))
+    checkpoints.update({str(CHAT_ID): 6})
+    assert saved_checkpoints() == {str(CHAT_ID): 5}
+
+    archive.close()
+    assert saved_checkpoints() == {str(CHAT_ID): 6}
+
+
+def test_segment_rolls_over_by_age_and_releases_the_checkpoint(archive, checkpoints, monkeypatch):
+    archive.add(1, line(1, "one"))
+    checkpoints.update({str(CHAT_ID): 1})
+    monkeypatch.setattr(app, "ARCHIVE_SEGMENT_SECONDS", 0)
+
+    archive.close_if_due()
+
+    assert archive.zip is None
+    assert saved_checkpoints() == {str(CHAT_ID): 1}
+
+
+def test_extract_reads_messages_across_blocks_with_media(archive, monkeypatch):
+    monkeypatch.setattr(app, "ARCHIVE_BLOCK_MESSAGES", 2)
+    media_path = os.path.join(archive.staging, "photo.jpg")
+    with open(media_path, "wb") as f:
+        f.write(b"jpeg")
+    for msg_id in range(1, 6):
+        archive.add(msg_id, line(msg_id, f"message {msg_id}"), media_path if msg_id == 4 else None)
+    archive.close()
+
+    record, extracted = app.extract_message(CHAT_ID, 4, dest="out")
+    assert record["text"] == "message 4"
+    with open(extracted, "rb") as f:
+        assert f.read() == b"jpeg"
+    assert not os.path.exists(media_path)
+    assert app.extract_message(CHAT_ID, 5)[0]["text"] == "message 5"
+    assert app.extract_message(CHAT_ID, 99) == (None, None)
+
+
+def test_later_edit_and_deletion_entries_win(archive):
+    archive.add(1, line(1, "original"))
+    archive.add(2, line(2, "keep me"))
+    archive.close()
+    archive.add(1, line(1, "edited", edited=True))
+    archive.add(2, app.JsonlExporter().render_deletion(2))
+    archive.close()
+
+    assert app.extract_message(CHAT_ID, 1)[0]["text"] == "edited"
+    assert app.extract_message(CHAT_ID, 2)[0] == {"id": 2, "deleted": True}
@@ -0,0 +1,87 @@
+import datetime
+import os
+
+import pytest
+
+import telegram_backup_v4 as app
+
+
+@pytest.fixture
+def backups(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "RETENTION_KEEP_DAYS", 0)
+    monkeypatch.setattr(app, "RETENTION_KEEP_MONTHLY", 0)
+    monkeypatch.setattr(app, "RETENTION_MAX_CHAT_BYTES", 0)
+
+    def make(day, chat="123", page_bytes=100, media_bytes=1000):
+        chat_dir = os.path.join(f"backup_{day}", chat)
+        os.makedirs(os.path.join(chat_dir, "media"), exist_ok=True)
+        os.makedirs(os.path.join(f"backup_{day}", "reports"), exist_ok=True)
+        with open(os.path.join(chat_dir, "messages.html"), "w") as f:
+            f.write("x" * page_bytes)
+        with open(os.path.join(chat_dir, "media", "photo.jpg"), "w") as f:
+            f.write("x" * media_bytes)
+        with open(os.path.join(f"backup_{day}", "reports", "run_120000.json"), "w") as f:
+            f.write("{}")
+
+    return make
+
+
+def prune(today):
+    ledger = app.SizeLedger()
+    ledger.seed()
+    return app.prune_backups(ledger, today), ledger
+
+
+def remaining():
+    return sorted(name[len("backup_"):] for name in os.listdir(".") if name.startswith("backup_"))
+
+
+def test_keep_days_keeps_exactly_n_days_and_removes_reports(backups, monkeypatch):
+    for day in range(1, 11):
+        backups(f"2020-01-{day:02d}")
+    monkeypatch.setattr(app, "RETENTION_KEEP_DAYS", 3)
+
+    (removed, freed), ledger = prune(datetime.date(2020, 1, 10))
+
+    assert remaining() == ["2020-01-08", "2020-01-09", "2020-01-10"]
+    assert removed == 7
+    assert freed == 7 * 1100
+    assert sorted(ledger.data) == ["2020-01-08", "2020-01-09", "2020-01-10"]
+
+
+def test_first_backup_of_recent_months_is_kept(backups, monkeypatch):
+    for day in ["2020-01-15", "2020-02-03", "2020-02-20", "2020-03-01", "2020-03-09", "2020-03-10"]:
+        backups(day)
+    monkeypatch.setattr(app, "RETENTION_KEEP_DAYS", 2)
+    monkeypatch.setattr(app, "RETENTION_KEEP_MONTHLY", 2)
+
+    prune(datetime.date(2020, 3, 10))
+
+    # 2020-01-15 is the oldest monthly day and falls outside the last two months
+    assert remaining() == ["2020-02-03", "2020-03-01", "2020-03-09", "2020-03-10"]
+
+
+def test_chat_cap_prunes_oldest_days_per_chat(backups, monkeypatch):
+    for day in ["2020-01-01", "2020-01-02", "2020-01-03"]:
+        backups(day, chat="123")
+    backups("2020-01-01", chat="456", media_bytes=10)
+    backups("2020-01-03", chat="456", media_bytes=10)
+    monkeypatch.setattr(app, "RETENTION_MAX_CHAT_BYTES", 2500)
+
+    (removed, _), _ = prune(datetime.date(2020, 1, 3))
+
+    assert removed == 1
+    assert not os.path.exists(os.path.join("backup_2020-01-01", "123"))
+    assert os.path.exists(os.path.join("backup_2020-01-01", "456"))
+    assert os.path.exists(os.path.join("backup_2020-01-02", "123"))
+
+
+def test_latest_day_of_a_chat_is_kept_even_over_the_cap(backups, monkeypatch):
+    backups("2020-01-01")
+    backups("2020-01-02")
+    monkeypatch.setattr(app, "RETENTION_MAX_CHAT_BYTES", 10)
+
+    prune(datetime.date(2020, 1, 2))
+
+    assert remaining() == ["2020-01-02"]